@@ -1,9 +1,11 @@
 import os
+import calendar
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
+from token_cache import token_cache
 
 load_dotenv()
 
@@ -12,11 +14,20 @@ SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-dev-key-change-in-prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 1 week expiration 
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# pbkdf2 cost; pick a value with `python bench_login.py calibrate --target-ms 100`.
+# When set, stored hashes with different rounds are re-hashed on next login.
+PBKDF2_ROUNDS = os.getenv("PBKDF2_ROUNDS")
+_rounds_settings = {"pbkdf2_sha256__rounds": int(PBKDF2_ROUNDS)} if PBKDF2_ROUNDS else {}
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto", **_rounds_settings)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """Returns (verified, new_hash); new_hash is set when the stored hash uses outdated parameters."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -26,7 +37,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -35,10 +46,24 @@ def create_password_reset_token(email: str):
     to_encode = {"exp": expire, "sub": email, "purpose": "password_reset"}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def decode_access_token(token: str) -> dict:
+    """Verified claims of `token`, raising JWTError. Verified tokens are cached until they expire."""
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, claims)
+    return claims
+
+def issued_before(claims: dict, moment: Optional[datetime]) -> bool:
+    """True if the token was issued before `moment` (naive UTC), e.g. a password change."""
+    if moment is None:
+        return False
+    return claims.get("iat", 0) < calendar.timegm(moment.utctimetuple())
+
 def decode_token(token: str) -> Optional[str]:
     """Decode a JWT token and return the subject (email)."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         return payload.get("sub")
     except JWTError:
         return None
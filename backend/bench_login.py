@@ -0,0 +1,134 @@
+"""
+Login throughput benchmark and pbkdf2 cost calibration.
+
+    python bench_login.py hash [--seconds 3] [--processes N]
+        Hashes/sec for the configured pwd_context, single core and across N cores.
+
+    python bench_login.py login --email user@example.com --password secret
+                                [--url http://127.0.0.1:8000] [--requests 200] [--concurrency 8]
+        Latency percentiles and throughput of POST /token against a running server.
+
+    python bench_login.py calibrate --target-ms 100
+        Picks pbkdf2_sha256 rounds so one hash takes about target-ms on this host
+        and prints the PBKDF2_ROUNDS line to put in .env.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.hash import pbkdf2_sha256
+
+import auth
+
+SAMPLE_PASSWORD = "benchmark-password-123"
+
+
+def _hashes_for(seconds: float) -> int:
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        auth.pwd_context.hash(SAMPLE_PASSWORD)
+        done += 1
+    return done
+
+
+def bench_hash(seconds: float, processes: int):
+    rounds = auth.pwd_context.handler().default_rounds
+    print(f"pbkdf2_sha256 rounds: {rounds}")
+    single = _hashes_for(seconds) / seconds
+    print(f"1 core:   {single:8.1f} hashes/sec ({1000 / single:.1f} ms/hash)")
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        total = sum(pool.map(_hashes_for, [seconds] * processes)) / seconds
+    print(f"{processes} cores: {total:8.1f} hashes/sec ({total / processes:.1f} per core)")
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def bench_login(url: str, email: str, password: str, requests: int, concurrency: int):
+    body = urllib.parse.urlencode({"username": email, "password": password}).encode()
+
+    def login(_):
+        req = urllib.request.Request(url.rstrip("/") + "/token", data=body, method="POST")
+        req.add_header("Content-Type", "application/x-www-form-urlencoded")
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as resp:
+                status = resp.status
+                resp.read()
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(login, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] * 1000 for r in results]
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"requests: {requests}, concurrency: {concurrency}, statuses: {json.dumps(statuses)}")
+    print(f"throughput: {requests / elapsed:.1f} logins/sec")
+    print(f"latency ms: p50={_percentile(latencies, 50):.1f} p95={_percentile(latencies, 95):.1f} "
+          f"p99={_percentile(latencies, 99):.1f} max={max(latencies):.1f} mean={statistics.mean(latencies):.1f}")
+
+
+def _ms_per_hash(rounds: int, samples: int = 5) -> float:
+    handler = pbkdf2_sha256.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash(SAMPLE_PASSWORD)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def calibrate(target_ms: float, min_rounds: int = 10000):
+    # pbkdf2 cost is linear in rounds: probe, extrapolate, then correct once
+    rounds = 20000
+    for _ in range(2):
+        rounds = max(min_rounds, int(rounds * target_ms / _ms_per_hash(rounds)))
+    measured = _ms_per_hash(rounds)
+    print(f"{rounds} rounds -> {measured:.1f} ms/hash, ~{1000 / measured:.1f} logins/sec per core")
+    if rounds == min_rounds and measured < target_ms * 0.5:
+        print(f"(clamped to the {min_rounds} round floor)")
+    print(f"PBKDF2_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    hash_cmd = commands.add_parser("hash")
+    hash_cmd.add_argument("--seconds", type=float, default=3.0)
+    hash_cmd.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+
+    login_cmd = commands.add_parser("login")
+    login_cmd.add_argument("--url", default="http://127.0.0.1:8000")
+    login_cmd.add_argument("--email", required=True)
+    login_cmd.add_argument("--password", required=True)
+    login_cmd.add_argument("--requests", type=int, default=200)
+    login_cmd.add_argument("--concurrency", type=int, default=8)
+
+    calibrate_cmd = commands.add_parser("calibrate")
+    calibrate_cmd.add_argument("--target-ms", type=float, default=100.0)
+
+    args = parser.parse_args()
+    if args.command == "hash":
+        bench_hash(args.seconds, args.processes)
+    elif args.command == "login":
+        bench_login(args.url, args.email, args.password, args.requests, args.concurrency)
+    else:
+        calibrate(args.target_ms)
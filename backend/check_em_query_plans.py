@@ -0,0 +1,187 @@
+"""
+Query plan check for the EM fact tables, meant to run after seeding.
+
+    python check_em_query_plans.py [--repeat 5]
+
+Runs each representative query below (the /api/em-data filters, exports,
+contract and delivery lookups) against the current database, prints its
+timing and plan, and exits 1 if any plan scans a whole fact table instead
+of using an index. Dimension tables are small and may be scanned.
+
+- SQLite: EXPLAIN QUERY PLAN; a "SCAN <fact table>" step without an index
+  is a failure.
+- PostgreSQL: EXPLAIN (FORMAT JSON) with enable_seqscan off, so the planner
+  only picks a sequential scan when no index fits; a "Seq Scan" on a fact
+  table is a failure. On tiny tables the planner would otherwise prefer a
+  scan even with a usable index.
+
+Parameters are taken from the seeded rows, so the check needs the EM tables
+populated (python import_em_data.py).
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+
+from sqlalchemy import text
+
+from database import engine
+
+FACT_TABLES = ("em_market_price", "em_contract", "em_delivery", "em_user_activity")
+
+# name -> (SQL, query that returns the parameters from seeded data)
+QUERIES = {
+    "price by fuel, region and time range": (
+        "SELECT * FROM em_market_price WHERE fuel_id = :fuel_id AND region_id = :region_id "
+        "AND timestamp BETWEEN :start AND :end ORDER BY timestamp",
+        "SELECT fuel_id, region_id, MIN(timestamp) AS start, MAX(timestamp) AS \"end\" FROM em_market_price "
+        "GROUP BY fuel_id, region_id LIMIT 1",
+    ),
+    "price by fuel name and region state": (
+        "SELECT p.* FROM em_market_price p "
+        "JOIN em_fuel_master f ON f.fuel_id = p.fuel_id "
+        "JOIN em_region_master r ON r.region_id = p.region_id "
+        "WHERE f.fuel_name = :fuel_name AND r.state = :state AND p.timestamp >= :start",
+        "SELECT f.fuel_name, r.state, MIN(p.timestamp) AS start FROM em_market_price p "
+        "JOIN em_fuel_master f ON f.fuel_id = p.fuel_id "
+        "JOIN em_region_master r ON r.region_id = p.region_id "
+        "WHERE f.fuel_name IS NOT NULL AND r.state IS NOT NULL "
+        "GROUP BY f.fuel_name, r.state LIMIT 1",
+    ),
+    "price by region and time range": (
+        "SELECT * FROM em_market_price WHERE region_id = :region_id AND timestamp >= :start",
+        "SELECT region_id, MIN(timestamp) AS start FROM em_market_price GROUP BY region_id LIMIT 1",
+    ),
+    "price by time range": (
+        "SELECT * FROM em_market_price WHERE timestamp BETWEEN :start AND :end",
+        "SELECT MIN(timestamp) AS start, MIN(timestamp) AS \"end\" FROM em_market_price",
+    ),
+    "latest price timestamp": (
+        "SELECT MAX(timestamp) FROM em_market_price",
+        None,
+    ),
+    "contracts by fuel and start date": (
+        "SELECT * FROM em_contract WHERE fuel_id = :fuel_id AND start_date >= :start",
+        "SELECT fuel_id, MIN(start_date) AS start FROM em_contract GROUP BY fuel_id LIMIT 1",
+    ),
+    "contracts by buyer": (
+        "SELECT * FROM em_contract WHERE buyer_id = :buyer_id",
+        "SELECT buyer_id FROM em_contract LIMIT 1",
+    ),
+    "contracts by producer": (
+        "SELECT * FROM em_contract WHERE producer_id = :producer_id",
+        "SELECT producer_id FROM em_contract LIMIT 1",
+    ),
+    "contracts by start date": (
+        "SELECT * FROM em_contract WHERE start_date BETWEEN :start AND :end",
+        "SELECT MIN(start_date) AS start, MIN(start_date) AS \"end\" FROM em_contract",
+    ),
+    "deliveries by contract": (
+        "SELECT * FROM em_delivery WHERE contract_id = :contract_id",
+        "SELECT contract_id FROM em_delivery LIMIT 1",
+    ),
+    "deliveries by status and date": (
+        "SELECT * FROM em_delivery WHERE delivery_status = :status AND actual_delivery_date >= :start",
+        "SELECT delivery_status AS status, MIN(actual_delivery_date) AS start FROM em_delivery "
+        "GROUP BY delivery_status LIMIT 1",
+    ),
+    "deliveries by date": (
+        "SELECT * FROM em_delivery WHERE actual_delivery_date BETWEEN :start AND :end",
+        "SELECT MIN(actual_delivery_date) AS start, MIN(actual_delivery_date) AS \"end\" FROM em_delivery",
+    ),
+    "activity by user and time range": (
+        "SELECT * FROM em_user_activity WHERE user_id = :user_id AND timestamp >= :start",
+        "SELECT user_id, MIN(timestamp) AS start FROM em_user_activity GROUP BY user_id LIMIT 1",
+    ),
+    "activity by time range": (
+        "SELECT * FROM em_user_activity WHERE timestamp BETWEEN :start AND :end",
+        "SELECT MIN(timestamp) AS start, MIN(timestamp) AS \"end\" FROM em_user_activity",
+    ),
+}
+
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN) (\w+)(?: (?!WHERE|JOIN|ON|ORDER|GROUP)(\w+))?")
+
+
+def _sqlite_plan(conn, sql, params):
+    # The plan names a table by its alias when the query gives it one
+    tables = {}
+    for table, alias in _TABLE_ALIAS.findall(sql):
+        tables[table] = table
+        if alias:
+            tables[alias] = table
+    steps = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+    scans = []
+    for step in steps:
+        match = _SQLITE_FULL_SCAN.match(step)
+        if match and tables.get(match.group(1), match.group(1)) in FACT_TABLES:
+            scans.append(tables.get(match.group(1), match.group(1)))
+    return steps, scans
+
+
+def _postgres_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _postgres_nodes(child)
+
+
+def _postgres_plan(conn, sql, params):
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    steps, scans = [], []
+    for node in _postgres_nodes(plan[0]["Plan"]):
+        relation = node.get("Relation Name")
+        steps.append(f"{node['Node Type']} {relation or ''}".strip())
+        if node["Node Type"] == "Seq Scan" and relation in FACT_TABLES:
+            scans.append(relation)
+    return steps, scans
+
+
+def check_query_plans(repeat: int = 5) -> list:
+    """Print each query's plan and timing; returns the names of queries that fully scan a fact table."""
+    failures = []
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SET enable_seqscan = off"))
+            explain = _postgres_plan
+        else:
+            explain = _sqlite_plan
+
+        for name, (sql, params_sql) in QUERIES.items():
+            params = {}
+            if params_sql:
+                row = conn.execute(text(params_sql)).mappings().first()
+                if row is None or any(value is None for value in row.values()):
+                    print(f"SKIP  {name}: no seeded rows")
+                    continue
+                params = dict(row)
+
+            steps, scans = explain(conn, sql, params)
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(sql), params).fetchall()
+            elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+
+            status = "FAIL" if scans else "ok"
+            print(f"{status:5} {name} ({elapsed_ms:.2f} ms)")
+            for step in steps:
+                print(f"        {step}")
+            if scans:
+                failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a representative EM query scans a whole fact table")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query for the timing")
+    args = parser.parse_args()
+
+    failures = check_query_plans(args.repeat)
+    if failures:
+        print(f"\n{len(failures)} queries scan a fact table: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll queries use an index.")
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-import models, schemas, auth
+import models, schemas
+from hashing import hash_password
 
 
 # ---# Participant CRUD
@@ -8,21 +8,16 @@ def get_participant(db: Session, participant_id: int):
     return db.query(models.Participant).filter(models.Participant.id == participant_id).first()
 
 def get_participant_by_email(db: Session, email: str):
-    return db.query(models.Participant).filter(func.lower(models.Participant.email) == email.lower()).first()
+    # Index seek on the normalised column instead of a lower(email) scan
+    return db.query(models.Participant).filter(models.Participant.email_normalized == models.normalize_email(email)).first()
 
 def create_participant(db: Session, participant: schemas.ParticipantCreate):
-    # Assuming 'auth' module is available or get_password_hash is directly accessible
-    # If 'auth' is a separate module, it needs to be imported.
-    # For now, I'll assume get_password_hash is directly accessible or auth is implied.
-    # Based on the instruction, it uses `auth.get_password_hash`, so I'll use that.
-    # If `auth` is not imported, this will cause an error.
-    # Given the context, it's likely `get_password_hash` from this file should be used,
-    # but I'm following the instruction faithfully.
-    hashed_password = auth.get_password_hash(participant.password)
+    # Hashed on the shared hashing pool (see hashing.py), not inline
+    hashed_password = hash_password(participant.password)
 
     # Map schema fields to model fields
     db_participant = models.Participant(
-        email=participant.email,
+        email=participant.email.strip(),
         name=participant.name,
         hashed_password=hashed_password,
         role=participant.role, # Map role to role (consistent now)
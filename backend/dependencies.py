@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from database import SessionLocal
 import crud, auth, schemas, models
 from typing import Generator
+from principal_cache import principal_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -16,15 +17,23 @@ def get_db() -> Generator:
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     try:
-        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        payload = auth.decode_access_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid credentials")
     except auth.JWTError:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    user = crud.get_participant_by_email(db, email=email)
+    user = principal_cache.get(db, email)
     if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
+        user = crud.get_participant_by_email(db, email=email)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal_cache.put(email, user)
+    # On the worker that handled the reset the cached principal was dropped, so this sees the new
+    # password_changed_at at once; other workers keep their snapshot, and so accept older tokens,
+    # for up to PRINCIPAL_CACHE_TTL_SECONDS
+    if auth.issued_before(payload, user.password_changed_at):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
     return user
 
 async def get_current_active_user(current_user: schemas.Participant = Depends(get_current_user)):
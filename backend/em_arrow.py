@@ -0,0 +1,109 @@
+"""
+Arrow/Parquet snapshots of every em_models table.
+
+    python em_arrow.py [--out em_snapshot] [--chunk-rows 50000]
+
+writes one <table>.parquet per EM table (dimensions and facts) into --out,
+ready for pandas.read_parquet or DuckDB. The same batches back the Arrow
+IPC stream served at /api/em/export/arrow/{table}.
+
+Record batches are built column-wise straight from cursor rows (yield_per),
+without ORM objects, and typed from the SQLAlchemy column types so dates and
+floats survive the round trip. pyarrow is imported lazily; it is only needed
+by these exports.
+"""
+
+import argparse
+import os
+import time
+
+from sqlalchemy import select, types
+from sqlalchemy.orm import Session
+
+import em_models
+from database import SessionLocal, engine
+
+DEFAULT_CHUNK_ROWS = 50000
+
+# Every EM data table in foreign key order, so dimensions come first; importer bookkeeping is skipped
+_EM_TABLE_NAMES = {
+    mapper.class_.__tablename__
+    for mapper in em_models.Base.registry.mappers
+    if mapper.class_.__module__ == em_models.__name__ and not mapper.class_.__tablename__.startswith("em_import_")
+}
+EM_TABLES = {table.name: table for table in em_models.Base.metadata.sorted_tables if table.name in _EM_TABLE_NAMES}
+
+
+def _pa():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Arrow exports need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def arrow_schema(table):
+    pa = _pa()
+    fields = []
+    for column in table.columns:
+        if isinstance(column.type, types.DateTime):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(column.type, types.Date):
+            arrow_type = pa.date32()
+        elif isinstance(column.type, types.Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, types.Float):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def record_batches(db: Session, table, schema=None, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """Yield pyarrow.RecordBatch objects of up to chunk_rows rows, in primary key order."""
+    pa = _pa()
+    schema = schema or arrow_schema(table)
+    statement = select(*table.columns).order_by(*table.primary_key.columns)
+    result = db.execute(statement.execution_options(yield_per=chunk_rows))
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def write_snapshot(out_dir: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> dict:
+    """One Parquet file per table; returns {table: rows written}."""
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    report = {}
+    db = SessionLocal()
+    try:
+        for name, table in EM_TABLES.items():
+            schema = arrow_schema(table)
+            rows = 0
+            with pq.ParquetWriter(os.path.join(out_dir, f"{name}.parquet"), schema) as writer:
+                for batch in record_batches(db, table, schema, chunk_rows):
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            report[name] = rows
+    finally:
+        db.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write every EM table to Parquet")
+    parser.add_argument("--out", default="em_snapshot")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    em_models.Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    report = write_snapshot(args.out, args.chunk_rows)
+    print(f"Snapshot written to {args.out} in {time.perf_counter() - started:.2f}s:")
+    for name, rows in report.items():
+        print(f"  {name}: {rows} rows")
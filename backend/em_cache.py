@@ -0,0 +1,81 @@
+"""
+Process-wide, immutable cache of the small EM dimension tables.
+
+em_fuel_master, em_region_master and em_user_master hold a handful of rows
+that every price query needs. They are loaded once into read-only mappings,
+swapped atomically by refresh_dimensions() after each import, and reloaded
+after EM_DIMENSION_CACHE_SECONDS so imports run by other workers show up.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import em_models
+from database import SessionLocal
+
+EM_DIMENSION_CACHE_SECONDS = float(os.getenv("EM_DIMENSION_CACHE_SECONDS", "300"))
+
+FuelRow = namedtuple("FuelRow", ["fuel_id", "fuel_name", "unit", "color_applicable"])
+RegionRow = namedtuple("RegionRow", ["region_id", "country", "state", "market_zone"])
+UserRow = namedtuple("UserRow", ["user_id", "user_role", "company_name", "industry"])
+
+
+class EmDimensions:
+    """Read-only snapshot; never mutated after construction."""
+
+    def __init__(self, fuels, regions, users):
+        self.fuels = MappingProxyType({row.fuel_id: row for row in fuels})
+        self.regions = MappingProxyType({row.region_id: row for row in regions})
+        self.users = MappingProxyType({row.user_id: row for row in users})
+        self.fuel_ids_by_name = MappingProxyType(_group(self.fuels.values(), "fuel_name", "fuel_id"))
+        self.region_ids_by_state = MappingProxyType(_group(self.regions.values(), "state", "region_id"))
+        self.loaded_at = time.monotonic()
+
+
+def _group(rows, key_field: str, value_field: str) -> dict:
+    groups = {}
+    for row in rows:
+        groups.setdefault(getattr(row, key_field), []).append(getattr(row, value_field))
+    return {key: tuple(values) for key, values in groups.items()}
+
+
+def _load(db: Session) -> EmDimensions:
+    fuels = [FuelRow(*row) for row in db.query(
+        em_models.EmFuel.fuel_id, em_models.EmFuel.fuel_name, em_models.EmFuel.unit, em_models.EmFuel.color_applicable)]
+    regions = [RegionRow(*row) for row in db.query(
+        em_models.EmRegion.region_id, em_models.EmRegion.country, em_models.EmRegion.state, em_models.EmRegion.market_zone)]
+    users = [UserRow(*row) for row in db.query(
+        em_models.EmUserMaster.user_id, em_models.EmUserMaster.user_role,
+        em_models.EmUserMaster.company_name, em_models.EmUserMaster.industry)]
+    return EmDimensions(fuels, regions, users)
+
+
+_dimensions: Optional[EmDimensions] = None
+_lock = threading.Lock()
+
+
+def refresh_dimensions(db: Session = None) -> EmDimensions:
+    global _dimensions
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        dimensions = _load(db)
+    finally:
+        if own_session:
+            db.close()
+    with _lock:
+        _dimensions = dimensions
+    return dimensions
+
+
+def get_dimensions(db: Session = None) -> EmDimensions:
+    dimensions = _dimensions
+    if dimensions is None or time.monotonic() - dimensions.loaded_at > EM_DIMENSION_CACHE_SECONDS:
+        dimensions = refresh_dimensions(db)
+    return dimensions
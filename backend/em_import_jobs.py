@@ -0,0 +1,306 @@
+"""
+Background runner for EM workbook imports.
+
+POST /api/em/seed queues a job and returns its id at once; a thread in the
+same process runs import_em_data.import_data() with a progress hook.
+
+- em_import_job records each job's lifecycle (queued, running, succeeded,
+  failed, cancelled) and its report or error. Its unique `active` column is
+  set only while a job is queued or running, so the database rejects a second
+  concurrent import from any worker.
+- Every EM_IMPORT_CANCEL_POLL_SECONDS the running job writes `heartbeat_at`
+  and a progress snapshot (phase, rows per table, ETA) to its row, and reads
+  `cancel_requested`, through which other workers cancel it. A job whose
+  heartbeat is older than EM_IMPORT_STALE_SECONDS is taken to be abandoned
+  (its process died) and its slot is reclaimed.
+- The process running the job answers status calls from memory, so it is
+  always current; other workers serve the last snapshot. SQLite allows one
+  writer, which while rows load is the import itself, so there the snapshot
+  and heartbeat are only written before loading starts; no other worker can
+  write, and so reclaim the slot, until the import commits or rolls back,
+  and their reads may fail with OperationalError (served as 503).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import em_models
+import import_em_data
+from database import SessionLocal, engine
+
+EM_IMPORT_STALE_SECONDS = int(os.getenv("EM_IMPORT_STALE_SECONDS", "300"))
+EM_IMPORT_CANCEL_POLL_SECONDS = float(os.getenv("EM_IMPORT_CANCEL_POLL_SECONDS", "2"))
+
+ACTIVE_SLOT = "em_import"
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class ImportAlreadyRunning(Exception):
+    def __init__(self, job_id: Optional[str]):
+        super().__init__(f"Import {job_id} is already running")
+        self.job_id = job_id
+
+
+class JobProgress(import_em_data.ImportProgress):
+    def __init__(self, job: dict):
+        self.job = job
+        self.job_id = job["job_id"]
+        self.phase_name = "queued"
+        self.sheet_rows = {}
+        self.rows_done = {}
+        self.cancelled = threading.Event()
+        self._started = None
+        self._next_poll = 0.0
+        # From start() on the import may hold SQLite's only write lock
+        self._loading = False
+
+    def start(self, sheet_rows):
+        self.sheet_rows = dict(sheet_rows)
+        self._started = time.monotonic()
+        self._sync(force=True)
+        self._loading = True
+
+    def phase(self, name):
+        self.phase_name = name
+        self._sync()
+
+    def rows(self, sheet, count):
+        self.rows_done[sheet] = self.rows_done.get(sheet, 0) + count
+
+    def check(self):
+        self._sync()
+        if self.cancelled.is_set():
+            raise import_em_data.ImportCancelled()
+
+    def _sync(self, force: bool = False):
+        """Write the heartbeat and progress snapshot and pick up cancel requests, at most once per poll interval."""
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return
+        if self._loading and engine.dialect.name == "sqlite":
+            # Our own import transaction locks other connections out, and no other worker can set
+            # cancel_requested meanwhile; polling would only wait out the busy timeout
+            return
+        self._next_poll = now + EM_IMPORT_CANCEL_POLL_SECONDS
+        db = SessionLocal()
+        try:
+            beat = datetime.utcnow()
+            db.query(em_models.EmImportJob).filter(em_models.EmImportJob.id == self.job_id).update({
+                "heartbeat_at": beat,
+                "progress": json.dumps(self.progress()),
+            })
+            db.commit()
+            self.job["heartbeat_at"] = _iso(beat)
+            if not self.cancelled.is_set():
+                if db.query(em_models.EmImportJob.cancel_requested).filter(em_models.EmImportJob.id == self.job_id).scalar():
+                    self.cancelled.set()
+        except OperationalError:
+            # Database busy; the next poll tries again
+            db.rollback()
+        finally:
+            db.close()
+
+    def progress(self) -> dict:
+        rows_done = dict(self.rows_done)
+        done = sum(rows_done.values())
+        total = sum(self.sheet_rows.values())
+        eta = None
+        if self._started is not None and 0 < done < total:
+            eta = round((time.monotonic() - self._started) * (total - done) / done, 1)
+        return {
+            "phase": self.phase_name,
+            "rows_total": total,
+            "rows_done": done,
+            "rows_per_table": rows_done,
+            "eta_seconds": eta,
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            **self.job,
+            "status": "cancelling" if self.cancelled.is_set() else self.job["status"],
+            **self.progress(),
+        }
+
+
+def _iso(moment):
+    return moment.isoformat() if moment else None
+
+
+def _job_dict(job: em_models.EmImportJob) -> dict:
+    if job.rows_per_table:
+        rows_per_table = json.loads(job.rows_per_table)
+        progress = {
+            "phase": job.status,
+            "rows_total": sum(rows_per_table.values()),
+            "rows_done": sum(rows_per_table.values()),
+            "rows_per_table": rows_per_table,
+            "eta_seconds": None,
+        }
+    else:
+        # Still queued or running, possibly in another worker: its last persisted snapshot
+        progress = json.loads(job.progress) if job.progress else {}
+    cancelling = job.cancel_requested and job.active is not None
+    return {
+        "job_id": job.id,
+        "status": "cancelling" if cancelling else job.status,
+        "phase": progress.get("phase", job.status),
+        "file": job.file_path,
+        "force": job.force,
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+        "heartbeat_at": _iso(job.heartbeat_at),
+        "rows_total": progress.get("rows_total", 0),
+        "rows_done": progress.get("rows_done", 0),
+        "rows_per_table": progress.get("rows_per_table", {}),
+        "eta_seconds": progress.get("eta_seconds"),
+        "report": json.loads(job.report) if job.report else None,
+        "error": job.error,
+    }
+
+
+class ImportJobRunner:
+    def __init__(self):
+        self._live = {}  # job_id -> (JobProgress, thread)
+        self._lock = threading.Lock()
+
+    def _reclaim_abandoned(self, db):
+        cutoff = datetime.utcnow() - timedelta(seconds=EM_IMPORT_STALE_SECONDS)
+        with self._lock:
+            local = set(self._live)
+        stale = db.query(em_models.EmImportJob).filter(
+            em_models.EmImportJob.active == ACTIVE_SLOT,
+            func.coalesce(em_models.EmImportJob.heartbeat_at, em_models.EmImportJob.created_at) < cutoff
+        ).all()
+        for job in stale:
+            if job.id in local:
+                continue
+            job.active = None
+            job.status = "failed"
+            job.error = "Abandoned: no heartbeat for EM_IMPORT_STALE_SECONDS"
+            job.finished_at = datetime.utcnow()
+        if stale:
+            db.commit()
+
+    def submit(self, file_path: str = "EM_1.xlsx", force: bool = False) -> dict:
+        """Queue an import and start it; raises ImportAlreadyRunning if one is queued or running."""
+        db = SessionLocal()
+        try:
+            self._reclaim_abandoned(db)
+            job = em_models.EmImportJob(
+                id=uuid.uuid4().hex,
+                status="queued",
+                active=ACTIVE_SLOT,
+                file_path=file_path,
+                force=force,
+                cancel_requested=False,
+                created_at=datetime.utcnow()
+            )
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                running = db.query(em_models.EmImportJob.id).filter(em_models.EmImportJob.active == ACTIVE_SLOT).scalar()
+                raise ImportAlreadyRunning(running)
+            job_id = job.id
+            progress = JobProgress(_job_dict(job))
+        except OperationalError:
+            if engine.dialect.name != "sqlite":
+                raise
+            # SQLite: an import running in another worker holds the only write lock
+            raise ImportAlreadyRunning(None)
+        finally:
+            db.close()
+
+        thread = threading.Thread(target=self._run, args=(job_id, file_path, force, progress),
+                                  name=f"em-import-{job_id[:8]}", daemon=True)
+        with self._lock:
+            self._live[job_id] = (progress, thread)
+        thread.start()
+        return self.status(job_id)
+
+    def _update(self, job_id: str, **values):
+        db = SessionLocal()
+        try:
+            db.query(em_models.EmImportJob).filter(em_models.EmImportJob.id == job_id).update(values)
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self, job_id: str, file_path: str, force: bool, progress: JobProgress):
+        started_at = datetime.utcnow()
+        self._update(job_id, status="running", started_at=started_at, heartbeat_at=started_at)
+        progress.job.update(status="running", started_at=_iso(started_at))
+        result = {"status": "succeeded"}
+        try:
+            report = import_em_data.import_data(file_path, force, progress)
+            result["report"] = json.dumps(report)
+        except import_em_data.ImportCancelled:
+            result["status"] = "cancelled"
+        except Exception as e:
+            logging.exception("EM import %s failed", job_id)
+            result.update(status="failed", error=str(e))
+        finally:
+            self._update(
+                job_id,
+                active=None,
+                finished_at=datetime.utcnow(),
+                rows_per_table=json.dumps(progress.rows_done),
+                **result
+            )
+            with self._lock:
+                self._live.pop(job_id, None)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            live = self._live.get(job_id)
+        if live is not None:
+            return live[0].snapshot()
+        db = SessionLocal()
+        try:
+            job = db.get(em_models.EmImportJob, job_id)
+            return _job_dict(job) if job is not None else None
+        finally:
+            db.close()
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Ask a queued or running job to stop; it rolls back at its next checkpoint."""
+        with self._lock:
+            live = self._live.get(job_id)
+        if live is not None:
+            live[0].cancelled.set()
+        else:
+            # Running in another worker, which polls this flag
+            db = SessionLocal()
+            try:
+                db.query(em_models.EmImportJob).filter(
+                    em_models.EmImportJob.id == job_id,
+                    em_models.EmImportJob.active == ACTIVE_SLOT
+                ).update({"cancel_requested": True})
+                db.commit()
+            finally:
+                db.close()
+        return self.status(job_id)
+
+    def stop(self, timeout: float = 30.0):
+        """Cancel this process's jobs and wait for them to roll back."""
+        with self._lock:
+            live = list(self._live.values())
+        for progress, _ in live:
+            progress.cancelled.set()
+        for _, thread in live:
+            thread.join(timeout)
+
+
+import_jobs = ImportJobRunner()
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -30,6 +30,12 @@ class EmUserMaster(Base):
 
 class EmMarketPrice(Base):
     __tablename__ = "em_market_price"
+    __table_args__ = (
+        # fuel + region + time range (price queries, exports), region + time, time only / latest
+        Index("ix_em_market_price_fuel_region_ts", "fuel_id", "region_id", "timestamp"),
+        Index("ix_em_market_price_region_ts", "region_id", "timestamp"),
+        Index("ix_em_market_price_ts", "timestamp"),
+    )
     price_id = Column(String, primary_key=True)
     fuel_id = Column(String, ForeignKey("em_fuel_master.fuel_id"))
     region_id = Column(String, ForeignKey("em_region_master.region_id"))
@@ -141,6 +147,12 @@ class EmSustainabilityRecord(Base):
 
 class EmContract(Base):
     __tablename__ = "em_contract"
+    __table_args__ = (
+        Index("ix_em_contract_fuel_start", "fuel_id", "start_date"),
+        Index("ix_em_contract_buyer", "buyer_id"),
+        Index("ix_em_contract_producer", "producer_id"),
+        Index("ix_em_contract_start", "start_date"),
+    )
     contract_id = Column(String, primary_key=True)
     buyer_id = Column(String, ForeignKey("em_buyer_profile.buyer_id"))
     producer_id = Column(String, ForeignKey("em_producer.producer_id"))
@@ -156,6 +168,11 @@ class EmContract(Base):
 
 class EmDelivery(Base):
     __tablename__ = "em_delivery"
+    __table_args__ = (
+        Index("ix_em_delivery_contract", "contract_id"),
+        Index("ix_em_delivery_status_date", "delivery_status", "actual_delivery_date"),
+        Index("ix_em_delivery_date", "actual_delivery_date"),
+    )
     delivery_id = Column(String, primary_key=True)
     contract_id = Column(String, ForeignKey("em_contract.contract_id"))
     route_id = Column(String, ForeignKey("em_logistics_route.route_id"))
@@ -169,9 +186,48 @@ class EmDelivery(Base):
 
 class EmUserActivity(Base):
     __tablename__ = "em_user_activity"
+    __table_args__ = (
+        Index("ix_em_user_activity_user_ts", "user_id", "timestamp"),
+        Index("ix_em_user_activity_ts", "timestamp"),
+    )
     activity_id = Column(String, primary_key=True)
     user_id = Column(String, ForeignKey("em_user_master.user_id"))
     event_type = Column(String)
     timestamp = Column(DateTime)
 
     user = relationship("EmUserMaster")
+
+# --- Import Bookkeeping ---
+
+class EmImportSheet(Base):
+    """Content hash of each workbook sheet as of the last successful import."""
+    __tablename__ = "em_import_sheet"
+    sheet = Column(String, primary_key=True)
+    content_hash = Column(String)
+    row_count = Column(Integer)
+    imported_at = Column(DateTime)
+
+class EmImportRow(Base):
+    """Fingerprint of every imported row, so re-imports touch only changed rows."""
+    __tablename__ = "em_import_row"
+    sheet = Column(String, primary_key=True)
+    row_key = Column(String, primary_key=True)
+    fingerprint = Column(String)
+
+class EmImportJob(Base):
+    """One background import. `active` is set only while queued or running; its unique constraint allows one at a time."""
+    __tablename__ = "em_import_job"
+    id = Column(String, primary_key=True)
+    status = Column(String)  # queued, running, succeeded, failed, cancelled
+    active = Column(String, unique=True, nullable=True)
+    file_path = Column(String)
+    force = Column(Boolean, default=False)
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # last sign of life from the running worker
+    progress = Column(Text, nullable=True)  # JSON, throttled snapshot while running
+    rows_per_table = Column(Text, nullable=True)  # JSON, final counts
+    report = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
@@ -0,0 +1,294 @@
+"""
+Columnar in-memory store of em_market_price.
+
+Prices are held as NumPy arrays partitioned by (fuel_id, region_id) and
+sorted by timestamp, so a filtered range query is a dict lookup plus two
+searchsorted calls per partition instead of a table scan. Categorical
+columns (price_type, currency) are stored as small integer codes.
+
+The store is built from one projection query on first use, rebuilt by
+refresh_price_store() after an import, and rebuilt if another process
+changed the table (checked at most every EM_SERIES_RECHECK_SECONDS). An
+import that only inserted prices merges them in with append_price_rows()
+instead of a rebuild.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import em_models
+from database import SessionLocal
+
+EM_SERIES_RECHECK_SECONDS = float(os.getenv("EM_SERIES_RECHECK_SECONDS", "30"))
+
+NAT = np.datetime64("NaT", "s")
+
+
+class Vocabulary:
+    """Interns strings to int32 codes; codes are append-only."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value) -> Optional[int]:
+        return self._codes.get(value)
+
+    def codes(self, values: Iterable) -> np.ndarray:
+        return np.fromiter((self.code(v) for v in values), dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(self.values, dtype=object)[codes] if len(codes) else np.empty(0, dtype=object)
+
+
+class PriceSeries:
+    """One (fuel, region) partition. Rows without a timestamp sort last (NaT)."""
+
+    __slots__ = ("timestamp", "price", "price_type", "currency", "dated")
+
+    def __init__(self, timestamp, price, price_type, currency):
+        order = np.argsort(timestamp, kind="stable")
+        self.timestamp = timestamp[order]
+        self.price = price[order]
+        self.price_type = price_type[order]
+        self.currency = currency[order]
+        # Rows with a timestamp occupy [0, dated)
+        self.dated = len(self.timestamp) - int(np.isnat(self.timestamp).sum())
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def window(self, start: Optional[np.datetime64], end: Optional[np.datetime64]) -> slice:
+        """Rows with start <= timestamp <= end; undated rows only when unbounded."""
+        if start is None and end is None:
+            return slice(0, len(self.timestamp))
+        dated = self.timestamp[:self.dated]
+        lo = 0 if start is None else int(np.searchsorted(dated, start, side="left"))
+        hi = len(dated) if end is None else int(np.searchsorted(dated, end, side="right"))
+        return slice(lo, max(lo, hi))
+
+    def merged(self, other: "PriceSeries") -> "PriceSeries":
+        """Both partitions' rows in one series, re-sorted by timestamp."""
+        return PriceSeries(
+            np.concatenate([self.timestamp, other.timestamp]),
+            np.concatenate([self.price, other.price]),
+            np.concatenate([self.price_type, other.price_type]),
+            np.concatenate([self.currency, other.currency]),
+        )
+
+
+class PriceStore:
+    def __init__(self):
+        self.partitions: Dict[Tuple[str, str], PriceSeries] = {}
+        self.price_types = Vocabulary()
+        self.currencies = Vocabulary()
+        self.row_count = 0
+        self.signature = None
+        self.checked_at = 0.0
+
+    @staticmethod
+    def table_signature(db: Session):
+        """
+        Changes whenever em_market_price may have: every import that touches the
+        sheet stamps its em_import_sheet row, which also covers in-place updates
+        of price_value, price_type or currency; count and latest timestamp catch
+        writes from outside the importer.
+        """
+        imported_at = db.query(em_models.EmImportSheet.imported_at).filter(
+            em_models.EmImportSheet.sheet == "market_price"
+        ).scalar()
+        count, latest = db.query(func.count(em_models.EmMarketPrice.price_id), func.max(em_models.EmMarketPrice.timestamp)).one()
+        return count, latest, imported_at
+
+    def _partition_rows(self, rows) -> Dict[Tuple[str, str], PriceSeries]:
+        """rows: sequence of (fuel_id, region_id, price_value, currency, price_type, timestamp)."""
+        if not rows:
+            return {}
+        fuel, region, price, currency, price_type, timestamp = zip(*rows)
+        keys = np.asarray([f"{f}\x1f{r}" for f, r in zip(fuel, region)], dtype=object)
+        timestamp = np.array([t if t is not None else NAT for t in timestamp], dtype="datetime64[s]")
+        price = np.array([p if p is not None else np.nan for p in price], dtype=float)
+        price_type = self.price_types.codes(price_type)
+        currency = self.currencies.codes(currency)
+
+        partitions = {}
+        _, inverse = np.unique(keys, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+        for idx in np.split(order, bounds):
+            fuel_id, region_id = fuel[idx[0]], region[idx[0]]
+            partitions[(fuel_id, region_id)] = PriceSeries(timestamp[idx], price[idx], price_type[idx], currency[idx])
+        return partitions
+
+    def build(self, db: Session):
+        rows = db.query(
+            em_models.EmMarketPrice.fuel_id,
+            em_models.EmMarketPrice.region_id,
+            em_models.EmMarketPrice.price_value,
+            em_models.EmMarketPrice.currency,
+            em_models.EmMarketPrice.price_type,
+            em_models.EmMarketPrice.timestamp,
+        ).all()
+        self.partitions = self._partition_rows(rows)
+        self.row_count = len(rows)
+        self.signature = self.table_signature(db)
+        self.checked_at = time.monotonic()
+
+    def append(self, rows):
+        """Merge newly inserted rows (same tuple shape as build) into their partitions."""
+        for key, series in self._partition_rows(rows).items():
+            current = self.partitions.get(key)
+            self.partitions[key] = series if current is None else current.merged(series)
+        self.row_count += len(rows)
+
+    def select(self, fuel_ids=None, region_ids=None, start: np.datetime64 = None, end: np.datetime64 = None):
+        """Yield ((fuel_id, region_id), series, slice) for each partition matching the filters."""
+        if fuel_ids is not None and region_ids is not None:
+            candidates = [((f, r), self.partitions.get((f, r))) for f in fuel_ids for r in region_ids]
+            candidates = [(key, series) for key, series in candidates if series is not None]
+        else:
+            candidates = list(self.partitions.items())
+        fuel_ids = None if fuel_ids is None else set(fuel_ids)
+        region_ids = None if region_ids is None else set(region_ids)
+        for (fuel_id, region_id), series in candidates:
+            if fuel_ids is not None and fuel_id not in fuel_ids:
+                continue
+            if region_ids is not None and region_id not in region_ids:
+                continue
+            window = series.window(start, end)
+            if window.stop > window.start:
+                yield (fuel_id, region_id), series, window
+
+
+price_store = PriceStore()
+_lock = threading.Lock()
+_built = False
+
+
+def get_price_store(db: Session = None) -> PriceStore:
+    """The process-wide store, built on first use and revalidated periodically."""
+    global _built
+    now = time.monotonic()
+    if _built and now - price_store.checked_at < EM_SERIES_RECHECK_SECONDS:
+        return price_store
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        with _lock:
+            if not _built:
+                price_store.build(db)
+                _built = True
+            elif now - price_store.checked_at >= EM_SERIES_RECHECK_SECONDS:
+                if PriceStore.table_signature(db) != price_store.signature:
+                    price_store.build(db)
+                price_store.checked_at = now
+    finally:
+        if own_session:
+            db.close()
+    return price_store
+
+
+def rebuild_price_store(db: Session = None):
+    global _built
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        with _lock:
+            price_store.build(db)
+            _built = True
+    finally:
+        if own_session:
+            db.close()
+
+
+def refresh_price_store(db: Session = None):
+    """Rebuild the store after an import if it has been built; an unused store stays unbuilt."""
+    if _built:
+        rebuild_price_store(db)
+
+
+def price_store_built() -> bool:
+    return _built
+
+
+def append_price_rows(db: Session, rows):
+    """
+    Merge rows an import just committed into the store if it has been built.
+    Rebuilds instead when the table holds more than the store plus `rows`,
+    i.e. some other change has not been picked up yet.
+    """
+    with _lock:
+        if not _built:
+            return
+        signature = PriceStore.table_signature(db)
+        if signature[0] != price_store.row_count + len(rows):
+            price_store.build(db)
+            return
+        price_store.append(rows)
+        price_store.signature = signature
+        price_store.checked_at = time.monotonic()
+
+
+INTERVALS = ("day", "week", "month")
+
+
+def _buckets(timestamp: np.ndarray, interval: str) -> np.ndarray:
+    """Bucket start as datetime64[D]; weeks start on Monday."""
+    days = timestamp.astype("datetime64[D]")
+    if interval == "day":
+        return days
+    if interval == "week":
+        # 1970-01-01 was a Thursday, so day 0 is 3 days past a Monday
+        return days - (days.astype(np.int64) + 3) % 7
+    return timestamp.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def resample(series: PriceSeries, window: slice, interval: str, price_type: Optional[int] = None) -> dict:
+    """
+    Aggregate one partition's window into (price_type, currency, bucket) groups.
+
+    Returns parallel arrays: price_type, currency, bucket, mean, min, max,
+    last, count. Undated rows and rows without a price are skipped.
+    """
+    timestamp = series.timestamp[window]
+    price = series.price[window]
+    type_codes = series.price_type[window]
+    currency = series.currency[window]
+    keep = ~np.isnat(timestamp) & ~np.isnan(price)
+    if price_type is not None:
+        keep &= type_codes == price_type
+    timestamp, price, type_codes, currency = timestamp[keep], price[keep], type_codes[keep], currency[keep]
+    if not len(price):
+        return None
+
+    bucket = _buckets(timestamp, interval)
+    # Primary key last; timestamp keeps each group in time order so "last" is the final element
+    order = np.lexsort((timestamp, bucket, currency, type_codes))
+    price, type_codes, currency, bucket = price[order], type_codes[order], currency[order], bucket[order]
+    change = (np.diff(type_codes) != 0) | (np.diff(currency) != 0) | (np.diff(bucket) != np.timedelta64(0, "D"))
+    starts = np.concatenate(([0], np.flatnonzero(change) + 1))
+    ends = np.append(starts[1:], len(price))
+    count = ends - starts
+    return {
+        "price_type": type_codes[starts],
+        "currency": currency[starts],
+        "bucket": bucket[starts],
+        "mean": np.add.reduceat(price, starts) / count,
+        "min": np.minimum.reduceat(price, starts),
+        "max": np.maximum.reduceat(price, starts),
+        "last": price[ends - 1],
+        "count": count,
+    }
@@ -0,0 +1,65 @@
+"""
+Dedicated executor for password hashing.
+
+pbkdf2 is CPU-bound; running it on the event loop stalls every in-flight
+request on the worker. Hashes run on a small thread pool instead (hashlib's
+pbkdf2_hmac releases the GIL), and the pool admits at most
+HASH_POOL_WORKERS + HASH_POOL_QUEUE jobs at once. Beyond that callers get
+HashingPoolBusy, which the app turns into a 503 with Retry-After.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import auth
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_POOL_QUEUE = int(os.getenv("HASH_POOL_QUEUE", "32"))
+
+
+class HashingPoolBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class HashingPool:
+    def __init__(self, workers: int = HASH_POOL_WORKERS, max_pending: int = HASH_POOL_QUEUE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """Run on the pool and wait; for sync handlers already off the event loop."""
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+hashing_pool = HashingPool()
+
+
+def hash_password(password: str) -> str:
+    return hashing_pool.run(auth.get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run_async(auth.verify_password, plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str):
+    return await hashing_pool.run_async(auth.verify_and_update_password, plain_password, hashed_password)
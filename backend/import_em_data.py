@@ -1,147 +1,469 @@
+"""
+Incremental import of the EM workbook into the em_* tables.
 
+    python import_em_data.py [--file EM_1.xlsx] [--force]
+
+After a successful import each sheet's content hash (em_import_sheet) and
+each row's fingerprint (em_import_row) are stored. On the next run a sheet
+whose hash is unchanged is skipped without being parsed; a changed sheet is
+streamed in IMPORT_CHUNK_ROWS chunks (openpyxl read-only mode) and diffed,
+and only its inserted, updated and deleted rows are written. --force
+re-checks every sheet regardless of its hash.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from xml.etree import ElementTree
+
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import bindparam, delete, insert, select, types, update
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine
-import em_models
-from datetime import datetime
+import em_models, em_cache, em_timeseries
+
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+
+# (sheet, model) in foreign key order. Sheet headers are the model's column
+# names, with " (PK)" / " (FK)" appended to key columns.
+TABLE_SPECS = [
+    ("fuel_master", em_models.EmFuel),
+    ("region_master", em_models.EmRegion),
+    ("user_master", em_models.EmUserMaster),
+    ("market_price", em_models.EmMarketPrice),
+    ("kpi_snapshot", em_models.EmKpiSnapshot),
+    ("external_data", em_models.EmExternalData),
+    ("producer", em_models.EmProducer),
+    ("producer_capacity", em_models.EmProducerCapacity),
+    ("buyer_profile", em_models.EmBuyerProfile),
+    ("buyer_demand", em_models.EmBuyerDemand),
+    ("logistics_partner", em_models.EmLogisticsPartner),
+    ("logistics_route", em_models.EmLogisticsRoute),
+    ("sustainability_record", em_models.EmSustainabilityRecord),
+    ("contract", em_models.EmContract),
+    ("delivery", em_models.EmDelivery),
+    ("user_activity", em_models.EmUserActivity),
+]
+_MODELS = {sheet: model for sheet, model in TABLE_SPECS}
+
+# Sheets are parsed in worker processes; 1 parses in-process
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# How often parse_sheets calls progress.check() while waiting on a worker
+SPOOL_POLL_SECONDS = 0.5
+
+# Strings pandas.read_excel treats as missing by default; kept so streamed imports store the same NULLs
+_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+_KEY_SUFFIX = re.compile(r"\s*\((PK|FK)\)\s*$")
+_DIMENSION = re.compile(rb'<(?:\w+:)?dimension ref="[A-Z]+\d+(?::[A-Z]+(\d+))?"')
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportProgress:
+    """Hooks import_data() calls as it works; this default does nothing."""
+
+    def start(self, sheet_rows: dict):
+        """Estimated data rows of each sheet about to be loaded."""
+
+    def phase(self, name: str):
+        pass
+
+    def rows(self, sheet: str, count: int):
+        """Another `count` rows of `sheet` have been applied."""
+
+    def check(self):
+        """Called between chunks; raise ImportCancelled to abort and roll back."""
+
+
+_NO_PROGRESS = ImportProgress()
+
+
+def _column_values(series: pd.Series, column_type) -> list:
+    """Convert a whole sheet column to Python values for `column_type`; blanks become None."""
+    if isinstance(column_type, (types.DateTime, types.Date)):
+        parsed = pd.to_datetime(series, errors="coerce")
+        values = np.array(parsed.dt.to_pydatetime() if isinstance(column_type, types.DateTime) else parsed.dt.date, dtype=object)
+        values[parsed.isna().to_numpy()] = None
+        return values.tolist()
+    if isinstance(column_type, types.Integer):
+        parsed = pd.to_numeric(series, errors="coerce").astype("Int64")
+    elif isinstance(column_type, types.Float):
+        parsed = pd.to_numeric(series, errors="coerce").astype(float)
+    else:
+        parsed = series.astype(object).where(series.isna(), series.astype(str))
+    return parsed.astype(object).where(parsed.notna(), None).tolist()
+
+
+def frame_to_records(df: pd.DataFrame, table) -> list:
+    """Rows of `df` as dicts keyed by column name, converted column-wise."""
+    df = df.rename(columns=lambda name: _KEY_SUFFIX.sub("", str(name)))
+    columns = {}
+    for column in table.columns:
+        if column.name in df.columns:
+            columns[column.name] = _column_values(df[column.name], column.type)
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def iter_sheet_chunks(file_path: str, sheet: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """
+    Stream one sheet as lists of typed records, at most chunk_rows each.
+
+    openpyxl's read-only mode parses the sheet XML incrementally, so only the
+    current chunk is ever held in memory.
+    """
+    table = _MODELS[sheet].__table__
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name) if name is not None else "" for name in header]
+        chunk = []
+        for row in rows:
+            row = [None if isinstance(value, str) and value in _NA_STRINGS else value for value in row]
+            if any(value is not None for value in row):
+                chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield frame_to_records(pd.DataFrame.from_records(chunk, columns=header), table)
+                chunk = []
+        if chunk:
+            yield frame_to_records(pd.DataFrame.from_records(chunk, columns=header), table)
+    finally:
+        workbook.close()
+
+
+def spool_sheet(file_path: str, sheet: str, spool_dir: str) -> str:
+    """Parse a sheet in a worker process, pickling its chunks one after another into a spool file."""
+    fd, path = tempfile.mkstemp(prefix=f"{sheet}-", suffix=".chunks", dir=spool_dir)
+    with os.fdopen(fd, "wb") as spool:
+        for chunk in iter_sheet_chunks(file_path, sheet):
+            pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_spool(path: str):
+    try:
+        with open(path, "rb") as spool:
+            while True:
+                try:
+                    yield pickle.load(spool)
+                except EOFError:
+                    return
+    finally:
+        # The spool directory may already be gone if the import was aborted
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
 
-def import_data():
+
+def parse_sheets(file_path: str, sheets: list, workers: int = IMPORT_WORKERS, progress: ImportProgress = _NO_PROGRESS):
+    """
+    Yield (sheet, chunk iterator) in the order given. With several workers,
+    independent sheets are parsed concurrently and their chunks spooled to
+    disk, so neither side holds a whole sheet. progress.check() keeps being
+    called while waiting on a worker, so a long parse still heartbeats and
+    can be cancelled.
+    """
+    if workers <= 1 or len(sheets) <= 1:
+        for sheet in sheets:
+            yield sheet, iter_sheet_chunks(file_path, sheet)
+        return
+    with tempfile.TemporaryDirectory(prefix="em-import-") as spool_dir:
+        # spawn, not fork: the importer also runs inside the API process, which has live threads
+        with ProcessPoolExecutor(max_workers=min(workers, len(sheets)), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [(sheet, pool.submit(spool_sheet, file_path, sheet, spool_dir)) for sheet in sheets]
+            try:
+                for sheet, future in futures:
+                    while not wait([future], timeout=SPOOL_POLL_SECONDS).done:
+                        progress.check()
+                    yield sheet, _read_spool(future.result())
+            except BaseException:
+                # Cancelled or failed: do not start parsing sheets nobody will read
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+
+def _sheet_parts(archive: zipfile.ZipFile) -> dict:
+    """{sheet name: archive part holding its XML}."""
+    parts = set(archive.namelist())
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    sheets = {}
+    for sheet in workbook.iter(f"{{{_MAIN_NS}}}sheet"):
+        target = targets.get(sheet.get(f"{{{_REL_NS}}}id"), "")
+        target = target[1:] if target.startswith("/") else "xl/" + target
+        if target in parts:
+            sheets[sheet.get("name")] = target
+    return sheets
+
+
+def sheet_hashes(file_path: str) -> dict:
+    """
+    {sheet name: sha256} over each sheet's XML plus the shared strings and
+    styles it refers to, read straight from the .xlsx archive without parsing
+    cells. Empty if the file is not an .xlsx archive.
+    """
+    try:
+        archive = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        return {}
+    with archive:
+        parts = set(archive.namelist())
+        shared = hashlib.sha256()
+        for part in ("xl/sharedStrings.xml", "xl/styles.xml"):
+            if part in parts:
+                _hash_part(archive, part, shared)
+        hashes = {}
+        for name, part in _sheet_parts(archive).items():
+            digest = shared.copy()
+            _hash_part(archive, part, digest)
+            hashes[name] = digest.hexdigest()
+    return hashes
+
+
+def sheet_row_estimates(file_path: str, sheets: list) -> dict:
+    """Data rows per sheet from each sheet's <dimension> element, which sits at the head of its XML."""
+    estimates = {}
+    try:
+        archive = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        return estimates
+    with archive:
+        parts = _sheet_parts(archive)
+        for sheet in sheets:
+            if sheet not in parts:
+                continue
+            with archive.open(parts[sheet]) as stream:
+                match = _DIMENSION.search(stream.read(16384))
+            if match:
+                estimates[sheet] = max(int(match.group(1) or 1) - 1, 0)
+    return estimates
+
+
+def _hash_part(archive: zipfile.ZipFile, part: str, digest):
+    with archive.open(part) as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+
+
+def _fingerprint(record: dict, names: list) -> str:
+    return hashlib.blake2b(json.dumps([record.get(name) for name in names], default=str).encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class SheetDelta:
+    sheet: str
+    table: object
+    content_hash: str = None
+    row_count: int = 0
+    inserted: int = 0
+    updated: int = 0
+    deleted: list = field(default_factory=list)
+    # Fingerprinted keys from the last import that are no longer in the sheet
+    stale_keys: list = field(default_factory=list)
+
+
+def _chunks(items: list):
+    for offset in range(0, len(items), IMPORT_CHUNK_ROWS):
+        yield items[offset:offset + IMPORT_CHUNK_ROWS]
+
+
+def upsert_sheet(db: Session, sheet: str, table, chunks, progress: ImportProgress = _NO_PROGRESS, sink: list = None) -> SheetDelta:
+    """
+    Apply one sheet's inserts and updates chunk by chunk, diffing against the
+    table's keys and the fingerprints of the last import. Deletions are only
+    collected here; delete_stale_rows() applies them once every sheet is in.
+    Inserted records are also appended to `sink` when one is given.
+    """
+    pk = table.primary_key.columns.values()[0]
+    names = [column.name for column in table.columns]
+    fingerprints = em_models.EmImportRow.__table__
+    existing = set(db.scalars(select(pk)))
+    previous = dict(db.query(em_models.EmImportRow.row_key, em_models.EmImportRow.fingerprint)
+                    .filter(em_models.EmImportRow.sheet == sheet))
+
+    delta = SheetDelta(sheet, table)
+    seen = set()
+    for records in chunks:
+        inserted, updated, changed = [], [], {}
+        for record in records:
+            key = record.get(pk.name)
+            if key is None or key in seen:
+                continue
+            seen.add(key)
+            fingerprint = _fingerprint(record, names)
+            if previous.get(key) == fingerprint and key in existing:
+                continue
+            changed[key] = fingerprint
+            if key not in existing:
+                inserted.append(record)
+            else:
+                # Also covers rows that exist but were never fingerprinted
+                updated.append(record)
+
+        if inserted:
+            db.execute(insert(table), inserted)
+            if sink is not None:
+                sink.extend(inserted)
+        if updated:
+            columns = [name for name in updated[0] if name != pk.name]
+            statement = update(table).where(pk == bindparam("_key")).values({name: bindparam(name) for name in columns})
+            db.execute(statement, [dict(record, _key=record[pk.name]) for record in updated])
+        if changed:
+            db.execute(delete(fingerprints).where(fingerprints.c.sheet == sheet, fingerprints.c.row_key.in_(list(changed))))
+            db.execute(insert(fingerprints), [{"sheet": sheet, "row_key": key, "fingerprint": fp} for key, fp in changed.items()])
+        delta.inserted += len(inserted)
+        delta.updated += len(updated)
+        progress.rows(sheet, len(records))
+        progress.check()
+
+    delta.row_count = len(seen)
+    delta.stale_keys = [key for key in previous if key not in seen]
+    delta.deleted = [key for key in delta.stale_keys if key in existing]
+    return delta
+
+
+def delete_stale_rows(db: Session, deltas: list):
+    """Deletes run children first, after every sheet's inserts and updates, to respect foreign keys."""
+    fingerprints = em_models.EmImportRow.__table__
+    for delta in reversed(deltas):
+        pk = delta.table.primary_key.columns.values()[0]
+        for keys in _chunks(delta.deleted):
+            db.execute(delete(delta.table).where(pk.in_(keys)))
+        for keys in _chunks(delta.stale_keys):
+            db.execute(delete(fingerprints).where(fingerprints.c.sheet == delta.sheet, fingerprints.c.row_key.in_(keys)))
+        db.merge(em_models.EmImportSheet(
+            sheet=delta.sheet,
+            content_hash=delta.content_hash,
+            row_count=delta.row_count,
+            imported_at=datetime.utcnow()
+        ))
+
+
+def print_report(report: dict):
+    print("Import report:")
+    for sheet, entry in report.items():
+        if entry["status"] == "changed":
+            print(f"  {sheet}: +{entry['inserted']} ~{entry['updated']} -{entry['deleted']}")
+        else:
+            print(f"  {sheet}: {entry['status']}")
+
+
+def import_data(file_path: str = "EM_1.xlsx", force: bool = False, progress: ImportProgress = _NO_PROGRESS):
+    """
+    Returns {sheet: {"status": ..., "inserted": n, "updated": n, "deleted": n}}.
+    Any error, including ImportCancelled, rolls the whole import back and is re-raised.
+    """
     # Create tables
     em_models.Base.metadata.create_all(bind=engine)
-    
+
     db = SessionLocal()
-    file_path = "EM_1.xlsx"
 
     try:
-        xl = pd.ExcelFile(file_path)
-        
-        # Helper to read sheet and replace NaN with None
-        def read_sheet(sheet_name):
-            if sheet_name in xl.sheet_names:
-                df = xl.parse(sheet_name)
-                return df.where(pd.notnull(df), None)
-            return pd.DataFrame()
-
-        print("Importing Dimensions...")
-        
-        # 1. Fuel Master
-        df_fuel = read_sheet('fuel_master')
-        for _, row in df_fuel.iterrows():
-            if not db.query(em_models.EmFuel).filter_by(fuel_id=row['fuel_id (PK)']).first():
-                db.add(em_models.EmFuel(
-                    fuel_id=row['fuel_id (PK)'],
-                    fuel_name=row['fuel_name'],
-                    unit=row['unit'],
-                    color_applicable=row['color_applicable']
-                ))
-        
-        # 2. Region Master
-        df_region = read_sheet('region_master')
-        for _, row in df_region.iterrows():
-             if not db.query(em_models.EmRegion).filter_by(region_id=row['region_id (PK)']).first():
-                db.add(em_models.EmRegion(
-                    region_id=row['region_id (PK)'],
-                    country=row['country'],
-                    state=row['state'],
-                    market_zone=row['market_zone']
-                ))
-
-        # 3. User Master
-        df_user = read_sheet('user_master')
-        for _, row in df_user.iterrows():
-            if not db.query(em_models.EmUserMaster).filter_by(user_id=row['user_id (PK)']).first():
-                db.add(em_models.EmUserMaster(
-                    user_id=row['user_id (PK)'],
-                    user_role=row['user_role'],
-                    company_name=row['company_name'],
-                    industry=row['industry']
-                ))
-        
-        db.commit()
-        print("Dimensions Imported.")
-
-        # 4. Market Prices
-        print("Importing Market Prices...")
-        df_price = read_sheet('market_price')
-        for _, row in df_price.iterrows():
-            if not db.query(em_models.EmMarketPrice).filter_by(price_id=row['price_id (PK)']).first():
-                ts = row['timestamp']
-                if isinstance(ts, str):
-                    ts = datetime.strptime(ts, '%Y-%m-%d')
-                
-                db.add(em_models.EmMarketPrice(
-                    price_id=row['price_id (PK)'],
-                    fuel_id=row['fuel_id (FK)'],
-                    region_id=row['region_id (FK)'],
-                    price_value=row['price_value'],
-                    currency=row['currency'],
-                    price_type=row['price_type'],
-                    timestamp=ts
-                ))
-        
-        # 5. Producer Profile
-        print("Importing Profiles...")
-        df_producer = read_sheet('producer')
-        for _, row in df_producer.iterrows():
-            if not db.query(em_models.EmProducer).filter_by(producer_id=row['producer_id (PK)']).first():
-                db.add(em_models.EmProducer(
-                    producer_id=row['producer_id (PK)'],
-                    user_id=row['user_id (FK)'],
-                    ownership_type=row['ownership_type'],
-                    location_region_id=row['location_region_id (FK)'],
-                    commissioned_year=row['commissioned_year']
-                ))
-
-        # 6. Buyer Profile
-        df_buyer = read_sheet('buyer_profile')
-        for _, row in df_buyer.iterrows():
-            if not db.query(em_models.EmBuyerProfile).filter_by(buyer_id=row['buyer_id (PK)']).first():
-                db.add(em_models.EmBuyerProfile(
-                    buyer_id=row['buyer_id (PK)'],
-                    user_id=row['user_id (FK)'],
-                    industry=row['industry'],
-                    price_sensitivity=row['price_sensitivity']
-                ))
-
-         # 7. Logistics Partner
-        df_logistics = read_sheet('logistics_partner')
-        for _, row in df_logistics.iterrows():
-             if not db.query(em_models.EmLogisticsPartner).filter_by(logistics_id=row['logistics_id (PK)']).first():
-                db.add(em_models.EmLogisticsPartner(
-                    logistics_id=row['logistics_id (PK)'],
-                    user_id=row['user_id (FK)'],
-                    transport_mode=row['transport_mode']
-                ))
+        progress.phase("hashing")
+        hashes = sheet_hashes(file_path)
+        known = dict(db.query(em_models.EmImportSheet.sheet, em_models.EmImportSheet.content_hash))
+        report = {}
+        pending = []
+        for sheet, model in TABLE_SPECS:
+            content_hash = hashes.get(sheet)
+            if content_hash and not force and known.get(sheet) == content_hash:
+                report[sheet] = {"status": "unchanged"}
+            else:
+                pending.append(sheet)
 
-        db.commit()
+        # Only open the workbook once some sheet actually needs parsing
+        if pending:
+            if hashes:
+                available = set(hashes)
+            else:
+                workbook = load_workbook(file_path, read_only=True)
+                available = set(workbook.sheetnames)
+                workbook.close()
+            for sheet in pending:
+                if sheet not in available:
+                    report[sheet] = {"status": "missing"}
+            pending = [sheet for sheet in pending if sheet in available]
 
-        # 8. Contracts (Example of Operation table)
-        print("Importing Contracts...")
-        df_contract = read_sheet('contract')
-        for _, row in df_contract.iterrows():
-            if not db.query(em_models.EmContract).filter_by(contract_id=row['contract_id (PK)']).first():
-                start = row['start_date'] if isinstance(row['start_date'], datetime) else datetime.strptime(str(row['start_date']), '%Y-%m-%d')
-                end = row['end_date'] if isinstance(row['end_date'], datetime) else datetime.strptime(str(row['end_date']), '%Y-%m-%d')
-                
-                db.add(em_models.EmContract(
-                    contract_id=row['contract_id (PK)'],
-                    buyer_id=row['buyer_id (FK)'],
-                    producer_id=row['producer_id (FK)'],
-                    fuel_id=row['fuel_id (FK)'],
-                    agreed_price=row['agreed_price'],
-                    volume=row['volume'],
-                    start_date=start,
-                    end_date=end
-                ))
+        progress.start(sheet_row_estimates(file_path, pending))
+        deltas = []
+        started = time.perf_counter()
+        # Inserted prices are kept only if a built store can take them without a rebuild
+        price_rows = [] if em_timeseries.price_store_built() else None
+        for sheet, chunks in parse_sheets(file_path, pending, progress=progress):
+            progress.phase(f"loading {sheet}")
+            sink = price_rows if sheet == "market_price" else None
+            delta = upsert_sheet(db, sheet, _MODELS[sheet].__table__, chunks, progress, sink)
+            delta.content_hash = hashes.get(sheet)
+            deltas.append(delta)
+        progress.phase("deleting")
+        delete_stale_rows(db, deltas)
+        for delta in deltas:
+            report[delta.sheet] = {
+                "status": "changed",
+                "inserted": delta.inserted,
+                "updated": delta.updated,
+                "deleted": len(delta.deleted),
+            }
+        print(f"Applied {len(pending)} sheets in {time.perf_counter() - started:.2f}s")
+        # Report in foreign key order
+        report = {sheet: report[sheet] for sheet, _ in TABLE_SPECS}
 
+        progress.check()
+        progress.phase("committing")
         db.commit()
+        em_cache.refresh_dimensions(db)
+        prices = next((d for d in deltas if d.table is em_models.EmMarketPrice.__table__), None)
+        if prices is not None and (prices.updated or prices.deleted or (prices.inserted and price_rows is None)):
+            em_timeseries.refresh_price_store(db)
+        elif prices is not None and prices.inserted:
+            em_timeseries.append_price_rows(db, [
+                (r.get("fuel_id"), r.get("region_id"), r.get("price_value"), r.get("currency"), r.get("price_type"), r.get("timestamp"))
+                for r in price_rows
+            ])
+        print_report(report)
         print("Import Successful!")
+        return report
 
+    except ImportCancelled:
+        print("Import cancelled, rolled back")
+        db.rollback()
+        raise
     except Exception as e:
         print(f"Error importing data: {e}")
         db.rollback()
+        raise
     finally:
         db.close()
 
 if __name__ == "__main__":
-    import_data()
+    parser = argparse.ArgumentParser(description="Import the EM workbook, applying only what changed since the last import")
+    parser.add_argument("--file", default="EM_1.xlsx")
+    parser.add_argument("--force", action="store_true", help="re-check every sheet even if its content hash is unchanged")
+    args = parser.parse_args()
+    try:
+        import_data(args.file, args.force)
+    except Exception:
+        raise SystemExit(1)
@@ -1,14 +1,21 @@
 
+from itertools import islice
+
 import pandas as pd
+from openpyxl import load_workbook
 
+# Read-only mode streams rows, so only the header and preview rows are parsed per sheet
 try:
-    xl = pd.ExcelFile("EM_1.xlsx")
-    print("Sheet names:", xl.sheet_names)
-    for sheet in xl.sheet_names:
-        df = xl.parse(sheet)
+    wb = load_workbook("EM_1.xlsx", read_only=True, data_only=True)
+    print("Sheet names:", wb.sheetnames)
+    for sheet in wb.sheetnames:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        df = pd.DataFrame.from_records(list(islice(rows, 2)), columns=header)
         print(f"\n--- Sheet: {sheet} ---")
-        print("Columns:", df.columns.tolist())
+        print("Columns:", header)
         print("First 2 rows:")
-        print(df.head(2).to_string())
+        print(df.to_string())
+    wb.close()
 except Exception as e:
     print(f"Error reading Excel: {e}")
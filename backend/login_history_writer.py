@@ -0,0 +1,115 @@
+"""
+Background writer for LoginHistory rows.
+
+/token queues a login event and returns; a daemon thread batches events and
+writes them with one bulk insert once LOGIN_HISTORY_BATCH_SIZE events are
+pending or LOGIN_HISTORY_FLUSH_SECONDS have passed since the first one.
+stop() drains whatever is still queued, so a graceful shutdown loses nothing.
+If the queue is full (LOGIN_HISTORY_MAX_QUEUE) new events are dropped and
+counted in `dropped` rather than written inline, which would block the event
+loop in /token.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import models
+from database import SessionLocal
+
+LOGIN_HISTORY_BATCH_SIZE = int(os.getenv("LOGIN_HISTORY_BATCH_SIZE", "200"))
+LOGIN_HISTORY_FLUSH_SECONDS = float(os.getenv("LOGIN_HISTORY_FLUSH_SECONDS", "1.0"))
+LOGIN_HISTORY_MAX_QUEUE = int(os.getenv("LOGIN_HISTORY_MAX_QUEUE", "10000"))
+
+_STOP = object()
+
+
+class LoginHistoryWriter:
+    def __init__(self, batch_size: int = LOGIN_HISTORY_BATCH_SIZE, flush_seconds: float = LOGIN_HISTORY_FLUSH_SECONDS,
+                 max_queue: int = LOGIN_HISTORY_MAX_QUEUE):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="login-history-writer", daemon=True)
+                self._thread.start()
+
+    def record(self, user_id: int, ip_address: str = None, user_agent: str = None):
+        row = {"user_id": user_id, "ip_address": ip_address, "user_agent": user_agent, "login_at": datetime.utcnow()}
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Writer is falling behind; never block the caller on a database write
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logging.warning(f"Login history queue full, {dropped} rows dropped so far")
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        pending = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if pending else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                pending.extend(self._drain())
+                self._write(pending)
+                return
+            if item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_seconds
+                pending.append(item)
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(pending)
+                pending = []
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return rows
+            if item is not _STOP:
+                rows.append(item)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(models.LoginHistory, rows)
+            db.commit()
+        except Exception:
+            logging.exception(f"Failed to write {len(rows)} login history rows")
+            db.rollback()
+        finally:
+            db.close()
+
+
+login_history_writer = LoginHistoryWriter()
@@ -1,21 +1,31 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import FileResponse, JSONResponse
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, timedelta
 from typing import List, Optional
 import pandas as pd
+import numpy as np
 import os
 import models, schemas, crud, auth, em_models, em_schemas # Added em_models
-from database import SessionLocal, engine
+import migrations, em_cache, em_timeseries
+from database import engine
+from dependencies import get_db, get_current_user
+from principal_cache import principal_cache
+from login_history_writer import login_history_writer
+from rate_limit import RateLimitMiddleware, client_ip
+from em_import_jobs import import_jobs, ImportAlreadyRunning, FINISHED_STATUSES
+from hashing import hashing_pool, hash_password, verify_and_update_password_async, HashingPoolBusy
 import logging
-from routers import trading, storage, marketplace, auth_flow, admin
+from routers import trading, storage, marketplace, auth_flow, admin, em_export
 
 # Create tables for both MVP and EM Data
 models.Base.metadata.create_all(bind=engine)
 em_models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
 
 app = FastAPI(title="CF-EnergX - H2 & CBG Marketplace")
 
@@ -25,6 +35,10 @@ app.include_router(storage.router)
 app.include_router(marketplace.router)
 app.include_router(auth_flow.router)
 app.include_router(admin.router)
+app.include_router(em_export.router)
+
+# Rate limit auth endpoints before any hashing or DB work (added first so CORS wraps it)
+app.add_middleware(RateLimitMiddleware)
 
 # Enable CORS for frontend
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -37,13 +51,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.exception_handler(HashingPoolBusy)
+async def hashing_pool_busy_handler(request: Request, exc: HashingPoolBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "1"})
+
+@app.on_event("startup")
+def start_login_history_writer():
+    login_history_writer.start()
+
+@app.on_event("shutdown")
+def shutdown_background_workers():
+    login_history_writer.stop()
+    import_jobs.stop()
+    hashing_pool.shutdown()
 
 # --- Auth Routes ---
 @app.post("/token", response_model=schemas.Token)
@@ -58,22 +78,25 @@ async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequ
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not auth.verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not verified:
         logging.warning(f"Invalid password for: {form_data.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored hash predates the current PBKDF2_ROUNDS, upgrade it transparently
+        user.hashed_password = new_hash
+        db.commit()
     
-    # Record Login History
-    history = models.LoginHistory(
+    # Record Login History (written in batches off the request path)
+    login_history_writer.record(
         user_id=user.id,
-        ip_address=request.client.host,
+        ip_address=client_ip(request.scope),
         user_agent=request.headers.get("user-agent")
     )
-    db.add(history)
-    db.commit()
 
     logging.info(f"Successful login for: {form_data.username}")
     access_token = auth.create_access_token(data={"sub": user.email})
@@ -129,9 +152,13 @@ def reset_password(request: schemas.PasswordResetConfirm, db: Session = Depends(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Update password
-    user.hashed_password = auth.get_password_hash(request.new_password)
+    user.hashed_password = hash_password(request.new_password)
+    user.password_changed_at = datetime.utcnow()
     db_token.is_used = True
     db.commit()
+    # Sessions issued before the reset are revoked; drop their cached state
+    principal_cache.invalidate(user.email)
+    auth.token_cache.invalidate_subject(user.email)
     
     return {"message": "Password updated successfully"}
 
@@ -147,20 +174,6 @@ def register_user(participant: schemas.ParticipantCreate, db: Session = Depends(
     access_token = auth.create_access_token(data={"sub": new_user.email})
     return {"access_token": access_token, "token_type": "bearer", "user": new_user}
 
-# --- Dependencies ---
-async def get_current_user(token: str = Depends(OAuth2PasswordBearer(tokenUrl="token")), db: Session = Depends(get_db)):
-    try:
-        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-    except auth.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    user = crud.get_participant_by_email(db, email=email)
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
-
 @app.get("/users/me", response_model=schemas.ParticipantDetail)
 async def read_users_me(current_user: schemas.Participant = Depends(get_current_user)):
     return current_user
@@ -188,6 +201,34 @@ def get_user_orders(user_id: int, db: Session = Depends(get_db), current_user: s
         raise HTTPException(status_code=403, detail="Not authorized to view these orders")
     return crud.get_orders_by_buyer(db=db, buyer_id=user_id)
 
+def _em_price_filters(dims, region, fuel, start, end):
+    """(fuel_ids, region_ids, start, end) for PriceStore.select, or None if a name matches nothing."""
+    # Names resolve to partition keys via the dimension cache; the time range becomes a searchsorted window
+    region_ids = fuel_ids = None
+    if region:
+        region_ids = dims.region_ids_by_state.get(region)
+        if not region_ids:
+            return None
+    if fuel:
+        fuel_ids = dims.fuel_ids_by_name.get(fuel)
+        if not fuel_ids:
+            return None
+    try:
+        start_ts = np.datetime64(start, "s") if start else None
+        end_ts = np.datetime64(end, "s") if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO dates")
+    return fuel_ids, region_ids, start_ts, end_ts
+
+def _em_labels(dims, fuel_id, region_id):
+    fuel_obj = dims.fuels.get(fuel_id)
+    region_obj = dims.regions.get(region_id)
+    return (
+        fuel_obj.fuel_name if fuel_obj else fuel_id,
+        region_obj.state if region_obj else region_id,
+        region_obj.country if region_obj else "",
+    )
+
 @app.get("/api/em-data")
 def get_em_data(
     region: Optional[str] = None,
@@ -196,41 +237,122 @@ def get_em_data(
     end: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    # Build base query
-    query = db.query(em_models.EmMarketPrice)
-    if region:
-        query = query.join(em_models.EmRegion, em_models.EmRegion.region_id == em_models.EmMarketPrice.region_id).filter(em_models.EmRegion.state == region)
-    if fuel:
-        query = query.join(em_models.EmFuel, em_models.EmFuel.fuel_id == em_models.EmMarketPrice.fuel_id).filter(em_models.EmFuel.fuel_name == fuel)
-    if start:
-        query = query.filter(em_models.EmMarketPrice.timestamp >= start)
-    if end:
-        query = query.filter(em_models.EmMarketPrice.timestamp <= end)
-    results = query.all()
-    if not results:
+    dims = em_cache.get_dimensions(db)
+    store = em_timeseries.get_price_store(db)
+    filters = _em_price_filters(dims, region, fuel, start, end)
+    if filters is None:
+        return []
+
+    data = []
+    for (fuel_id, region_id), series, window in store.select(*filters):
+        fuel_label, region_label, country = _em_labels(dims, fuel_id, region_id)
+        timestamps = series.timestamp[window]
+        dates = np.where(np.isnat(timestamps), "", np.datetime_as_string(timestamps, unit="D"))
+        for price, currency, price_type, day in zip(
+            series.price[window].tolist(),
+            store.currencies.decode(series.currency[window]),
+            store.price_types.decode(series.price_type[window]),
+            dates.tolist(),
+        ):
+            data.append({
+                "Fuel": fuel_label,
+                "Region": region_label,
+                "Country": country,
+                "Price": f"{price} {currency}",
+                "Type": price_type,
+                "Date": day,
+            })
+    return data
+
+@app.get("/api/em-data/aggregate")
+def get_em_data_aggregate(
+    interval: str = "day",
+    region: Optional[str] = None,
+    fuel: Optional[str] = None,
+    price_type: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """One row per fuel/region/price type/currency and day, week (from Monday) or month."""
+    if interval not in em_timeseries.INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(em_timeseries.INTERVALS)}")
+    dims = em_cache.get_dimensions(db)
+    store = em_timeseries.get_price_store(db)
+    filters = _em_price_filters(dims, region, fuel, start, end)
+    if filters is None:
         return []
+    type_code = None
+    if price_type:
+        type_code = store.price_types.lookup(price_type)
+        if type_code is None:
+            return []
+
     data = []
-    for price in results:
-        fuel_obj = db.query(em_models.EmFuel).filter(em_models.EmFuel.fuel_id == price.fuel_id).first()
-        region_obj = db.query(em_models.EmRegion).filter(em_models.EmRegion.region_id == price.region_id).first()
-        data.append({
-            "Fuel": fuel_obj.fuel_name if fuel_obj else price.fuel_id,
-            "Region": region_obj.state if region_obj else price.region_id,
-            "Country": region_obj.country if region_obj else "",
-            "Price": f"{price.price_value} {price.currency}",
-            "Type": price.price_type,
-            "Date": price.timestamp.strftime('%Y-%m-%d') if price.timestamp else "",
-        })
+    for (fuel_id, region_id), series, window in store.select(*filters):
+        groups = em_timeseries.resample(series, window, interval, type_code)
+        if groups is None:
+            continue
+        fuel_label, region_label, country = _em_labels(dims, fuel_id, region_id)
+        for row in zip(
+            store.price_types.decode(groups["price_type"]),
+            store.currencies.decode(groups["currency"]),
+            np.datetime_as_string(groups["bucket"], unit="D").tolist(),
+            groups["mean"].tolist(),
+            groups["min"].tolist(),
+            groups["max"].tolist(),
+            groups["last"].tolist(),
+            groups["count"].tolist(),
+        ):
+            data.append({
+                "Fuel": fuel_label,
+                "Region": region_label,
+                "Country": country,
+                "Type": row[0],
+                "Currency": row[1],
+                "Period": row[2],
+                "Mean": row[3],
+                "Min": row[4],
+                "Max": row[5],
+                "Last": row[6],
+                "Count": row[7],
+            })
+    data.sort(key=lambda row: row["Period"])
     return data
 
-@app.post("/api/em/seed")
-def seed_em_data():
-    import import_em_data
+@app.post("/api/em/seed", status_code=202)
+def seed_em_data(force: bool = False):
+    """Start a background import of EM_1.xlsx; poll /api/em/seed/{job_id} for progress."""
+    try:
+        return import_jobs.submit("EM_1.xlsx", force)
+    except ImportAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail={"message": "An import is already running", "job_id": e.job_id})
+
+def _import_db_busy():
+    # SQLite: an import running in another worker locks the database until it commits
+    return HTTPException(status_code=503, detail="Database busy with an import, retry shortly", headers={"Retry-After": "5"})
+
+@app.get("/api/em/seed/{job_id}")
+def get_em_seed_job(job_id: str):
+    try:
+        job = import_jobs.status(job_id)
+    except OperationalError:
+        raise _import_db_busy()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+@app.post("/api/em/seed/{job_id}/cancel", status_code=202)
+def cancel_em_seed_job(job_id: str):
     try:
-        import_em_data.import_data()
-        return {"message": "Data imported successfully"}
-    except Exception as e:
-         raise HTTPException(status_code=500, detail=str(e))
+        job = import_jobs.status(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Import job not found")
+        if job["status"] in FINISHED_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Import already {job['status']}")
+        return import_jobs.cancel(job_id)
+    except OperationalError:
+        raise _import_db_busy()
 
 # --- Frontend Serving ---
 # Mount frontend directory
@@ -0,0 +1,93 @@
+"""
+Time-limited stock holds for marketplace checkout.
+
+Holds are rows in stock_holds, so every worker sees the same reservations.
+A hold counts against the item's stock until expires_at; expired rows are
+ignored by every query and deleted when the next hold on that item is placed.
+
+Every path that checks stock against live holds and then writes (placing a
+hold, ordering, checking out) first locks the item rows with lock_items(), so
+the check and the write are atomic per item across workers. All functions
+run in the caller's transaction; none commits.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+DEFAULT_HOLD_TTL_SECONDS = 600
+MAX_HOLD_TTL_SECONDS = 1800
+
+
+def lock_items(db: Session, item_ids: Iterable[int]) -> Dict[int, models.MarketplaceItem]:
+    """Lock the items' rows until commit and return them by id; unknown ids are left out."""
+    ids = sorted(set(item_ids))
+    if db.bind.dialect.name == "sqlite":
+        # No row locks on SQLite; a write takes the database write lock, which serialises these the same way
+        db.query(models.MarketplaceItem).filter(models.MarketplaceItem.id.in_(ids)).update(
+            {models.MarketplaceItem.id: models.MarketplaceItem.id}, synchronize_session=False
+        )
+    # Locked in id order, so two carts sharing items cannot deadlock
+    items = db.query(models.MarketplaceItem).filter(models.MarketplaceItem.id.in_(ids)) \
+        .order_by(models.MarketplaceItem.id).with_for_update().all()
+    return {item.id: item for item in items}
+
+
+def held_quantities(db: Session, item_ids: Iterable[int]) -> Dict[int, int]:
+    """Units under live holds per item; items without holds are left out."""
+    rows = db.query(models.StockHold.item_id, func.sum(models.StockHold.quantity)).filter(
+        models.StockHold.item_id.in_(list(item_ids)),
+        models.StockHold.expires_at > datetime.utcnow()
+    ).group_by(models.StockHold.item_id)
+    return {item_id: int(total or 0) for item_id, total in rows}
+
+
+def place(db: Session, item: models.MarketplaceItem, buyer_id: int, quantity: int, ttl_seconds: int) -> Optional[models.StockHold]:
+    """Hold `quantity` units of a locked item if its stock minus live holds covers them, else return None."""
+    now = datetime.utcnow()
+    db.query(models.StockHold).filter(
+        models.StockHold.item_id == item.id,
+        models.StockHold.expires_at <= now
+    ).delete(synchronize_session=False)
+    if (item.stock_quantity or 0) - held_quantities(db, [item.id]).get(item.id, 0) < quantity:
+        return None
+    hold = models.StockHold(
+        hold_id=uuid.uuid4().hex,
+        item_id=item.id,
+        buyer_id=buyer_id,
+        quantity=quantity,
+        expires_at=now + timedelta(seconds=ttl_seconds),
+    )
+    db.add(hold)
+    return hold
+
+
+def get(db: Session, hold_id: str, buyer_id: int) -> Optional[models.StockHold]:
+    """The buyer's live hold, or None if unknown, expired or another buyer's."""
+    return db.query(models.StockHold).filter(
+        models.StockHold.hold_id == hold_id,
+        models.StockHold.buyer_id == buyer_id,
+        models.StockHold.expires_at > datetime.utcnow()
+    ).first()
+
+
+def claim(db: Session, hold_id: str, buyer_id: int) -> Optional[models.StockHold]:
+    """
+    Delete the buyer's live hold and return it, detached; None if there is
+    none. Of two concurrent claims only one deletes the row, and rolling the
+    transaction back restores the hold.
+    """
+    hold = get(db, hold_id, buyer_id)
+    if hold is None:
+        return None
+    deleted = db.query(models.StockHold).filter(
+        models.StockHold.hold_id == hold_id,
+        models.StockHold.expires_at > datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.expunge(hold)
+    return hold if deleted == 1 else None
@@ -0,0 +1,140 @@
+"""
+In-place schema upgrades for databases created before a column existed.
+
+create_all() only creates missing tables, so new columns on existing tables
+are added here. Every step checks the live schema first and is safe to run
+on each startup; one-off data backfills are recorded in schema_migrations.
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+import em_models
+import models
+import storage_occupancy
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _columns(engine: Engine, table: str) -> set:
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def _run_once(engine: Engine, name: str, step) -> bool:
+    """
+    Run a data migration step(conn) once per database. The marker row commits
+    with the step, so a failed step is retried on the next startup, and a
+    worker racing another one fails on the marker's primary key and skips it.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR PRIMARY KEY, applied_at TIMESTAMP)"))
+        if conn.execute(text("SELECT 1 FROM schema_migrations WHERE name = :name"), {"name": name}).first():
+            return False
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :now)"),
+                         {"name": name, "now": datetime.utcnow()})
+            step(conn)
+    except IntegrityError:
+        return False
+    except OperationalError as e:
+        # SQLite: another worker holds the write lock while it runs this step
+        logging.warning(f"Skipped migration {name}, will retry on next startup: {e}")
+        return False
+    logging.info(f"Applied migration {name}")
+    return True
+
+
+def _add_column(engine: Engine, table: str, column: str, ddl_type: str) -> bool:
+    if column in _columns(engine, table):
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    except (OperationalError, ProgrammingError):
+        # Every gunicorn worker migrates on boot; one that lost the race finds a duplicate column
+        if column in _columns(engine, table):
+            return False
+        raise
+    logging.info(f"Added column {table}.{column}")
+    return True
+
+
+def migrate_participant_email_normalized(engine: Engine):
+    _add_column(engine, "participants", "email_normalized", "VARCHAR")
+
+    # Backfill rows written before the column existed (or by raw SQL), committing each chunk
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, email FROM participants WHERE email_normalized IS NULL AND email IS NOT NULL LIMIT :n"
+            ), {"n": BACKFILL_CHUNK_SIZE}).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                text("UPDATE participants SET email_normalized = :normalized WHERE id = :id"),
+                [{"id": row.id, "normalized": models.normalize_email(row.email)} for row in rows]
+            )
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_participants_email_normalized ON participants (email_normalized)"
+            ))
+    except (IntegrityError, OperationalError, ProgrammingError) as e:
+        # Accounts differing only by case must be merged by hand before the index can exist
+        logging.error(f"Could not create unique index on participants.email_normalized: {e}")
+
+
+def migrate_participant_password_changed_at(engine: Engine):
+    _add_column(engine, "participants", "password_changed_at", "TIMESTAMP")
+
+
+def migrate_storage_booking_volume(engine: Engine):
+    _add_column(engine, "storage_bookings", "volume", "FLOAT")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_storage_bookings_listing_id ON storage_bookings (listing_id)"
+        ))
+
+
+def migrate_storage_occupancy_backfill(engine: Engine):
+    # Bookings made before storage_occupancy_days existed are missing from the calendar
+    _run_once(engine, "storage_occupancy_backfill", storage_occupancy.rebuild_calendar)
+
+
+def migrate_em_import_job_heartbeat(engine: Engine):
+    _add_column(engine, "em_import_job", "heartbeat_at", "TIMESTAMP")
+    _add_column(engine, "em_import_job", "progress", "TEXT")
+
+
+def ensure_em_indexes(engine: Engine):
+    """create_all() skips indexes on tables that already exist; add any declared EM index that is missing."""
+    for table in em_models.Base.metadata.sorted_tables:
+        if not table.name.startswith("em_") or not inspect(engine).has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+            except (OperationalError, ProgrammingError):
+                # Created by another worker migrating at the same time
+                if index.name in {i["name"] for i in inspect(engine).get_indexes(table.name)}:
+                    continue
+                raise
+            logging.info(f"Created index {index.name}")
+
+
+def run_migrations(engine: Engine):
+    migrate_participant_email_normalized(engine)
+    migrate_participant_password_changed_at(engine)
+    migrate_storage_booking_volume(engine)
+    migrate_storage_occupancy_backfill(engine)
+    migrate_em_import_job_heartbeat(engine)
+    ensure_em_indexes(engine)
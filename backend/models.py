@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date, Boolean, Enum
+from sqlalchemy.orm import relationship, validates
 import enum
 from datetime import datetime
 from database import Base
@@ -38,6 +38,10 @@ class OrderStatus(str, enum.Enum):
     CANCELLED = "CANCELLED"
     DISPUTED = "DISPUTED"
 
+def normalize_email(email: str) -> str:
+    """Canonical form used for all participant lookups."""
+    return email.strip().lower()
+
 # --- Models ---
 
 class Participant(Base):
@@ -46,7 +50,9 @@ class Participant(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
+    email_normalized = Column(String, unique=True, index=True) # lookup key, see normalize_email
     hashed_password = Column(String)
+    password_changed_at = Column(DateTime, nullable=True) # tokens issued earlier are rejected
     
     # Extended Profile
     role = Column(String) # PRODUCER, BUYER, LOGISTICS, REGULATOR
@@ -74,6 +80,11 @@ class Participant(Base):
     logistics_assets = relationship("LogisticsAsset", back_populates="provider")
     inventory = relationship("Inventory", back_populates="owner")
 
+    @validates("email")
+    def _set_email_normalized(self, key, value):
+        self.email_normalized = normalize_email(value) if value else None
+        return value
+
 class Facility(Base):
     """Production Plant, Storage Hub, or Warehouse"""
     __tablename__ = "facilities"
@@ -182,6 +193,24 @@ class LoginHistory(Base):
 
     user = relationship("Participant")
 
+class LoginHistoryDaily(Base):
+    """Per-user daily login counts, rolled up from old login_history rows by retention.py"""
+    __tablename__ = "login_history_daily"
+    user_id = Column(Integer, ForeignKey("participants.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    login_count = Column(Integer, default=0)
+    first_login_at = Column(DateTime)
+    last_login_at = Column(DateTime)
+
+class OTPCode(Base):
+    """Pending signup OTPs, shared by all workers (see otp_store.py)"""
+    __tablename__ = "otp_codes"
+    email = Column(String, primary_key=True)
+    otp = Column(String)
+    phone = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
 # --- New Features Models ---
 
 class TradeOrder(Base):
@@ -238,17 +267,28 @@ class StorageBooking(Base):
     __tablename__ = "storage_bookings"
 
     id = Column(Integer, primary_key=True, index=True)
-    listing_id = Column(Integer, ForeignKey("storage_listings.id"))
+    listing_id = Column(Integer, ForeignKey("storage_listings.id"), index=True)
     renter_id = Column(Integer, ForeignKey("participants.id"))
     
     start_date = Column(DateTime)
     end_date = Column(DateTime)
+    volume = Column(Float) # Booked capacity, same unit as listing capacity_available
     total_price = Column(Float)
     status = Column(String, default="CONFIRMED")
     
     listing = relationship("StorageRentalListing")
     renter = relationship("Participant")
 
+class StorageOccupancyDay(Base):
+    """Booked volume and revenue per listing per day, maintained as bookings change"""
+    __tablename__ = "storage_occupancy_days"
+
+    listing_id = Column(Integer, ForeignKey("storage_listings.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+
+    booked_volume = Column(Float, default=0.0)
+    revenue = Column(Float, default=0.0)
+
 class MarketplaceItem(Base):
     __tablename__ = "marketplace_items"
 
@@ -281,6 +321,16 @@ class MarketplaceOrder(Base):
     item = relationship("MarketplaceItem")
     buyer = relationship("Participant")
 
+class StockHold(Base):
+    """Units of an item reserved for one buyer until expires_at, visible to every worker"""
+    __tablename__ = "stock_holds"
+
+    hold_id = Column(String, primary_key=True)
+    item_id = Column(Integer, ForeignKey("marketplace_items.id"), index=True)
+    buyer_id = Column(Integer, ForeignKey("participants.id"))
+    quantity = Column(Integer)
+    expires_at = Column(DateTime, index=True)
+
 class Inventory(Base):
     __tablename__ = "inventory"
 
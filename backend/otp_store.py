@@ -0,0 +1,164 @@
+"""
+Pluggable store for signup OTPs.
+
+Every entry expires after OTP_TTL_SECONDS and the store never holds more than
+OTP_STORE_MAX_ENTRIES codes. The backend is picked from OTP_STORE_URL:
+
+    (unset) / db://   otp_codes table in the app database, shared by all workers
+    redis://...       Redis or a Redis-compatible server (needs `pip install redis`)
+    memory://         per-process dict, only for single-worker dev runs
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+from database import SessionLocal
+
+OTP_STORE_URL = os.getenv("OTP_STORE_URL", "")
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+OTP_STORE_MAX_ENTRIES = int(os.getenv("OTP_STORE_MAX_ENTRIES", "10000"))
+
+
+def _key(email: str) -> str:
+    return email.strip().lower()
+
+
+class OTPStore(ABC):
+    @abstractmethod
+    def put(self, email: str, otp: str, phone: str):
+        ...
+
+    @abstractmethod
+    def get(self, email: str) -> Optional[dict]:
+        """Returns {"otp": ..., "phone": ...} or None if missing or expired."""
+
+    @abstractmethod
+    def delete(self, email: str):
+        ...
+
+
+class MemoryOTPStore(OTPStore):
+    def __init__(self, ttl_seconds: int = OTP_TTL_SECONDS, max_entries: int = OTP_STORE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # email -> (deadline, data), oldest first
+        self._lock = threading.Lock()
+
+    def put(self, email, otp, phone):
+        with self._lock:
+            self._entries.pop(_key(email), None)
+            self._entries[_key(email)] = (time.monotonic() + self.ttl_seconds, {"otp": otp, "phone": phone})
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, email):
+        with self._lock:
+            entry = self._entries.get(_key(email))
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[_key(email)]
+                return None
+            return entry[1]
+
+    def delete(self, email):
+        with self._lock:
+            self._entries.pop(_key(email), None)
+
+
+class DatabaseOTPStore(OTPStore):
+    def __init__(self, ttl_seconds: int = OTP_TTL_SECONDS, max_entries: int = OTP_STORE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def put(self, email, otp, phone):
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.query(models.OTPCode).filter(models.OTPCode.expires_at <= now).delete(synchronize_session=False)
+            # One upsert, so two requests for the same email replace the code instead of colliding on the key
+            table = models.OTPCode.__table__
+            insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+            statement = insert(table).values(
+                email=_key(email),
+                otp=otp,
+                phone=phone,
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds)
+            )
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.email],
+                set_={
+                    "otp": statement.excluded.otp,
+                    "phone": statement.excluded.phone,
+                    "created_at": statement.excluded.created_at,
+                    "expires_at": statement.excluded.expires_at,
+                },
+            ))
+            overflow = db.query(models.OTPCode).count() - self.max_entries
+            if overflow > 0:
+                oldest = db.query(models.OTPCode.email).order_by(models.OTPCode.created_at).limit(overflow).subquery()
+                db.query(models.OTPCode).filter(models.OTPCode.email.in_(oldest.select())).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self, email):
+        db = SessionLocal()
+        try:
+            entry = db.query(models.OTPCode).filter(
+                models.OTPCode.email == _key(email),
+                models.OTPCode.expires_at > datetime.utcnow()
+            ).first()
+            return {"otp": entry.otp, "phone": entry.phone} if entry else None
+        finally:
+            db.close()
+
+    def delete(self, email):
+        db = SessionLocal()
+        try:
+            db.query(models.OTPCode).filter(models.OTPCode.email == _key(email)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+class RedisOTPStore(OTPStore):
+    """Entries expire via SETEX; the size cap is left to the server's maxmemory policy."""
+
+    prefix = "otp:"
+
+    def __init__(self, url: str, ttl_seconds: int = OTP_TTL_SECONDS):
+        import redis  # optional, only needed when OTP_STORE_URL points at Redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def put(self, email, otp, phone):
+        self.client.setex(self.prefix + _key(email), self.ttl_seconds, json.dumps({"otp": otp, "phone": phone}))
+
+    def get(self, email):
+        raw = self.client.get(self.prefix + _key(email))
+        return json.loads(raw) if raw else None
+
+    def delete(self, email):
+        self.client.delete(self.prefix + _key(email))
+
+
+def create_otp_store(url: str = OTP_STORE_URL) -> OTPStore:
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisOTPStore(url)
+    if url.startswith("memory://"):
+        return MemoryOTPStore()
+    return DatabaseOTPStore()
+
+
+otp_store = create_otp_store()
@@ -0,0 +1,75 @@
+"""
+Short-lived cache of authenticated participants, keyed by token subject.
+
+Entries are detached snapshots of the Participant row. On a hit the snapshot
+is merged into the request session with load=False, which attaches it without
+issuing a query; relationships still lazy-load through that session.
+
+Snapshots are per process and only invalidated in the process that changed
+the row, so other workers can serve a stale principal, including its
+password_changed_at and therefore token revocation, for up to
+PRINCIPAL_CACHE_TTL_SECONDS. Lower it to tighten that window.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+import models
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+
+
+def _snapshot(user: models.Participant) -> models.Participant:
+    state = {attr.key: getattr(user, attr.key) for attr in inspect(models.Participant).column_attrs}
+    snapshot = models.Participant(**state)
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # subject -> (deadline, snapshot)
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, subject: str) -> Optional[models.Participant]:
+        key = subject.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            snapshot = entry[1]
+        return db.merge(snapshot, load=False)
+
+    def put(self, subject: str, user: models.Participant):
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        entry = (time.monotonic() + self.ttl_seconds, _snapshot(user))
+        with self._lock:
+            self._entries[subject.lower()] = entry
+            self._entries.move_to_end(subject.lower())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject.lower(), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
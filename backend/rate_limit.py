@@ -0,0 +1,186 @@
+"""
+Token-bucket rate limiting for the expensive auth endpoints.
+
+Requests to login, signup, password reset and the signup flow are charged
+against a per-IP bucket and, when the body names an account (form `username`
+or JSON `email`), a per-account bucket. An empty bucket short-circuits to 429
+before the route runs, so no hashing or DB work happens.
+
+The IP is the ASGI client address, which behind a reverse proxy is the
+proxy's, so every client would share one bucket. Set
+RATE_LIMIT_TRUSTED_PROXY_HOPS to the number of proxies in front of the app
+(render.yaml sets 1) and the IP is read from X-Forwarded-For instead, that
+many entries from the right: each proxy appends the address it saw, so
+those entries are the ones a client cannot forge. Entries further left are
+whatever the client sent and are never used.
+
+Buckets are two-element lists [tokens, last_refill] in a dict per limiter.
+Buckets that have refilled completely carry no information and are pruned
+every RATE_LIMIT_PRUNE_SECONDS.
+"""
+
+import json
+import os
+import time
+from math import ceil
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "60"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_ACCOUNT_PER_MINUTE = float(os.getenv("RATE_LIMIT_ACCOUNT_PER_MINUTE", "10"))
+RATE_LIMIT_ACCOUNT_BURST = float(os.getenv("RATE_LIMIT_ACCOUNT_BURST", "5"))
+RATE_LIMIT_PRUNE_SECONDS = float(os.getenv("RATE_LIMIT_PRUNE_SECONDS", "60"))
+RATE_LIMIT_TRUSTED_PROXY_HOPS = int(os.getenv("RATE_LIMIT_TRUSTED_PROXY_HOPS", "0"))
+
+LIMITED_PATHS = ("/token", "/users/", "/auth/forgot-password", "/auth/reset-password")
+LIMITED_PREFIXES = ("/auth-flow/",)
+
+# Only bodies up to this size are inspected for an account name
+MAX_INSPECTED_BODY = 64 * 1024
+
+
+class TokenBuckets:
+    def __init__(self, per_minute: float, burst: float, prune_seconds: float = RATE_LIMIT_PRUNE_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst, 1.0)
+        self.prune_seconds = prune_seconds
+        self._buckets = {}
+        self._next_prune = time.monotonic() + prune_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, key: str, now: float = None) -> float:
+        """Spend one token for `key`. Returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_prune:
+            self.prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [self.capacity - 1, now]
+            return 0.0
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def prune(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        refill = self.capacity / self.rate
+        self._buckets = {key: b for key, b in self._buckets.items() if now - b[1] < refill}
+        self._next_prune = now + self.prune_seconds
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def client_ip(scope, trusted_hops: int = RATE_LIMIT_TRUSTED_PROXY_HOPS):
+    """The client address per the trusted proxy hops above; login history records the same one."""
+    client = scope.get("client")
+    address = client[0] if client else None
+    if trusted_hops <= 0:
+        return address
+    forwarded = b",".join(value for name, value in scope.get("headers") or [] if name == b"x-forwarded-for")
+    hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",") if hop.strip()]
+    # Fewer entries than proxies means the request did not come through all of them
+    return hops[-trusted_hops] if len(hops) >= trusted_hops else address
+
+
+def _account_from_body(headers: dict, body: bytes):
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    try:
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            values = parse_qs(body.decode("utf-8")).get("username")
+            return values[0].strip().lower() if values else None
+        if content_type.startswith("application/json"):
+            payload = json.loads(body or b"null")
+            email = payload.get("email") if isinstance(payload, dict) else None
+            return email.strip().lower() if isinstance(email, str) else None
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return None
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware; the request body is buffered and replayed to the app."""
+
+    def __init__(self, app, ip_buckets: TokenBuckets = None, account_buckets: TokenBuckets = None,
+                 trusted_proxy_hops: int = RATE_LIMIT_TRUSTED_PROXY_HOPS):
+        self.app = app
+        self.trusted_proxy_hops = trusted_proxy_hops
+        self.ip_buckets = ip_buckets or TokenBuckets(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST)
+        self.account_buckets = account_buckets or TokenBuckets(RATE_LIMIT_ACCOUNT_PER_MINUTE, RATE_LIMIT_ACCOUNT_BURST)
+
+    def _limited(self, scope) -> bool:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return False
+        path = scope["path"]
+        return path in LIMITED_PATHS or path.startswith(LIMITED_PREFIXES)
+
+    async def _reject(self, scope, receive, send, retry_after: float):
+        response = JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests, please retry later"},
+            headers={"Retry-After": str(max(1, ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if not self._limited(scope):
+            await self.app(scope, receive, send)
+            return
+
+        ip = client_ip(scope, self.trusted_proxy_hops)
+        if self.ip_buckets.enabled and ip:
+            wait = self.ip_buckets.take(ip)
+            if wait:
+                await self._reject(scope, receive, send, wait)
+                return
+
+        if not self.account_buckets.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        try:
+            content_length = int(headers.get(b"content-length", b"0") or 0)
+        except ValueError:
+            # Malformed header: leave the body alone and let the server reject it
+            content_length = MAX_INSPECTED_BODY + 1
+        if content_length > MAX_INSPECTED_BODY:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        account = _account_from_body(headers, body)
+        if account:
+            wait = self.account_buckets.take(account)
+            if wait:
+                await self._reject(scope, receive, send, wait)
+                return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
@@ -0,0 +1,117 @@
+"""
+Retention job for auth tables, meant for cron rather than the request path.
+
+    python retention.py [--login-history-days 90] [--chunk-size 5000]
+
+- password_reset_tokens: deletes used or expired tokens.
+- login_history: rows older than --login-history-days are folded into
+  login_history_daily (one row per user per day) and then deleted.
+
+Work happens in chunks of --chunk-size rows, each committed on its own, so
+the job never holds long locks and can be interrupted safely.
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, engine
+
+DEFAULT_LOGIN_HISTORY_DAYS = 90
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def purge_reset_tokens(db: Session, now: datetime, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.query(models.PasswordResetToken.id).filter(
+            or_(models.PasswordResetToken.is_used == True, models.PasswordResetToken.expires_at < now)
+        ).limit(chunk_size)]
+        if not ids:
+            return deleted
+        db.query(models.PasswordResetToken).filter(models.PasswordResetToken.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+
+
+def _roll_up(db: Session, rows):
+    """Fold (id, user_id, login_at) rows into login_history_daily. Returns daily rows touched."""
+    days = defaultdict(lambda: [0, None, None])
+    for _, user_id, login_at in rows:
+        summary = days[(user_id, login_at.date())]
+        summary[0] += 1
+        summary[1] = login_at if summary[1] is None else min(summary[1], login_at)
+        summary[2] = login_at if summary[2] is None else max(summary[2], login_at)
+
+    existing = {
+        (d.user_id, d.day): d for d in db.query(models.LoginHistoryDaily).filter(
+            models.LoginHistoryDaily.user_id.in_({key[0] for key in days}),
+            models.LoginHistoryDaily.day.in_({key[1] for key in days})
+        )
+    }
+    new_rows = []
+    for (user_id, day), (count, first, last) in days.items():
+        daily = existing.get((user_id, day))
+        if daily is None:
+            new_rows.append({"user_id": user_id, "day": day, "login_count": count, "first_login_at": first, "last_login_at": last})
+        else:
+            daily.login_count = (daily.login_count or 0) + count
+            daily.first_login_at = min(daily.first_login_at or first, first)
+            daily.last_login_at = max(daily.last_login_at or last, last)
+    if new_rows:
+        db.bulk_insert_mappings(models.LoginHistoryDaily, new_rows)
+    return len(days)
+
+
+def compact_login_history(db: Session, cutoff: datetime, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    rolled_up = daily_rows = 0
+    while True:
+        rows = db.query(models.LoginHistory.id, models.LoginHistory.user_id, models.LoginHistory.login_at).filter(
+            models.LoginHistory.login_at < cutoff,
+            models.LoginHistory.user_id.isnot(None)
+        ).order_by(models.LoginHistory.id).limit(chunk_size).all()
+        if not rows:
+            return rolled_up, daily_rows
+        daily_rows += _roll_up(db, rows)
+        db.query(models.LoginHistory).filter(
+            models.LoginHistory.id.in_([row[0] for row in rows])
+        ).delete(synchronize_session=False)
+        db.commit()
+        rolled_up += len(rows)
+
+
+def run_retention(login_history_days: int = DEFAULT_LOGIN_HISTORY_DAYS, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    report = {}
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        report["reset_tokens_deleted"] = purge_reset_tokens(db, now, chunk_size)
+        report["reset_tokens_seconds"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        rolled_up, daily_rows = compact_login_history(db, now - timedelta(days=login_history_days), chunk_size)
+        report["login_history_rows_rolled_up"] = rolled_up
+        report["login_history_daily_rows_touched"] = daily_rows
+        report["login_history_seconds"] = round(time.perf_counter() - started, 3)
+    finally:
+        db.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge reset tokens and roll up old login history")
+    parser.add_argument("--login-history-days", type=int, default=DEFAULT_LOGIN_HISTORY_DAYS)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    report = run_retention(args.login_history_days, args.chunk_size)
+    print("Retention report:")
+    for key, value in report.items():
+        print(f"  {key}: {value}")
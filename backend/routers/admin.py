@@ -4,6 +4,7 @@ from sqlalchemy import func
 from typing import List
 import models, schemas
 import dependencies
+from principal_cache import principal_cache
 
 router = APIRouter(
     prefix="/admin",
@@ -49,6 +50,7 @@ def update_user_status(
         
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate(user.email)
     return user
 
 @router.get("/analytics", response_model=schemas.AdminAnalytics)
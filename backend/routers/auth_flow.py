@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from database import SessionLocal
-import models, schemas, auth
+import models, schemas, auth, crud
 from datetime import timedelta
+from hashing import hash_password
+from otp_store import otp_store
 
 router = APIRouter(
     prefix="/auth-flow",
@@ -17,19 +19,16 @@ def get_db():
     finally:
         db.close()
 
-# Simulated OTP Store (In-memory for prototype)
-OTP_STORE = {} 
-
 @router.post("/step1-identity", response_model=schemas.SignupStep1Response)
 def step1_identity(request: schemas.SignupStep1Request, db: Session = Depends(get_db)):
     # 1. Check if user already exists
-    user = db.query(models.Participant).filter(models.Participant.email == request.email).first()
+    user = crud.get_participant_by_email(db, email=request.email)
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # 2. Generate Simulated OTP
     simulated_otp = "123456"  # Static for demo
-    OTP_STORE[request.email] = {"otp": simulated_otp, "phone": request.phone}
+    otp_store.put(request.email, simulated_otp, request.phone)
     
     print(f" [SIMULATION] OTP for {request.email}: {simulated_otp}")
     
@@ -41,10 +40,11 @@ def step1_identity(request: schemas.SignupStep1Request, db: Session = Depends(ge
 
 @router.post("/step2-verify-otp", response_model=schemas.VerifyOTPResponse)
 def step2_verify_otp(request: schemas.VerifyOTPRequest, db: Session = Depends(get_db)):
-    stored_data = OTP_STORE.get(request.email)
+    stored_data = otp_store.get(request.email)
     
     if not stored_data or stored_data["otp"] != request.otp:
         raise HTTPException(status_code=400, detail="Invalid OTP")
+    otp_store.delete(request.email)
     
     # Generate a temp token
     temp_token = auth.create_access_token(
@@ -65,15 +65,15 @@ def step3_kyc_complete(request: schemas.KYCComplaintRequest, db: Session = Depen
         raise HTTPException(status_code=400, detail="Invalid or expired verification token. Please restart signup.")
     
     # 2. Check if user already exists (edge case)
-    existing_user = db.query(models.Participant).filter(models.Participant.email == email).first()
+    existing_user = crud.get_participant_by_email(db, email=email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Account already exists. Please login instead.")
     
     # 3. Create User
-    hashed_password = auth.get_password_hash(request.password)
+    hashed_password = hash_password(request.password)
     
     db_user = models.Participant(
-        email=email,
+        email=email.strip(),
         hashed_password=hashed_password,
         name=request.full_name,
         role=request.role,
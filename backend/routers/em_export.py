@@ -0,0 +1,164 @@
+"""
+Streaming exports of the EM tables: CSV/NDJSON for the large fact tables,
+Arrow IPC for any table (see em_arrow).
+
+Rows are read through a server-side cursor EXPORT_CHUNK_ROWS at a time and
+written out chunk by chunk, so memory stays flat however wide the range is.
+The generator opens its own session because the request-scoped one is closed
+before a streaming body starts.
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime, date
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import em_arrow
+import em_models
+from database import SessionLocal
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# table name -> (model, time column for start/end, columns usable as equality filters)
+EXPORT_TABLES = {
+    "market_price": (em_models.EmMarketPrice, "timestamp", ("fuel_id", "region_id", "price_type", "currency")),
+    "contract": (em_models.EmContract, "start_date", ("buyer_id", "producer_id", "fuel_id")),
+    "delivery": (em_models.EmDelivery, "actual_delivery_date", ("contract_id", "route_id", "logistics_id", "delivery_status")),
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+router = APIRouter(
+    prefix="/api/em/export",
+    tags=["EM Export"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def _parse_time(name: str, value: str):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def _chunks(statement):
+    db = SessionLocal()
+    try:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        for rows in result.partitions():
+            yield rows
+    finally:
+        db.close()
+
+
+def _csv_stream(columns, statement):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in _chunks(statement):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def _ndjson_stream(columns, statement):
+    for rows in _chunks(statement):
+        yield "".join(
+            json.dumps(dict(zip(columns, map(_plain, row)))) + "\n"
+            for row in rows
+        )
+
+
+def _arrow_stream(table, schema):
+    import pyarrow as pa
+
+    buffer = io.BytesIO()
+    db = SessionLocal()
+    try:
+        with pa.ipc.new_stream(buffer, schema) as writer:
+            for batch in em_arrow.record_batches(db, table, schema, EXPORT_CHUNK_ROWS):
+                writer.write_batch(batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        # End-of-stream marker
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+@router.get("/arrow/{table}")
+def export_em_table_arrow(table: str):
+    """
+    Stream any EM table (full name, e.g. em_market_price) as an Arrow IPC stream;
+    read with pyarrow.ipc.open_stream or DuckDB.
+    """
+    if table not in em_arrow.EM_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table, expected one of {', '.join(em_arrow.EM_TABLES)}")
+    try:
+        schema = em_arrow.arrow_schema(em_arrow.EM_TABLES[table])
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return StreamingResponse(
+        _arrow_stream(em_arrow.EM_TABLES[table], schema),
+        media_type="application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": f'attachment; filename="{table}.arrows"'},
+    )
+
+
+@router.get("/{table}")
+def export_em_table(
+    table: str,
+    request: Request,
+    format: str = "csv",
+    start: str = None,
+    end: str = None,
+):
+    """
+    Stream one EM fact table as CSV or NDJSON.
+
+    start/end bound the table's time column (inclusive); any other query
+    parameter must name one of the table's filter columns and matches exactly.
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table, expected one of {', '.join(EXPORT_TABLES)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    model, time_column, filter_columns = EXPORT_TABLES[table]
+
+    columns = [column.name for column in model.__table__.columns]
+    statement = select(*model.__table__.columns)
+    if start:
+        statement = statement.where(model.__table__.c[time_column] >= _parse_time("start", start))
+    if end:
+        statement = statement.where(model.__table__.c[time_column] <= _parse_time("end", end))
+    for name, value in request.query_params.items():
+        if name in ("format", "start", "end"):
+            continue
+        if name not in filter_columns:
+            raise HTTPException(status_code=400, detail=f"Cannot filter {table} on {name}")
+        statement = statement.where(model.__table__.c[name] == value)
+    # Primary key order keeps exports stable and lets the database walk the PK index
+    statement = statement.order_by(*model.__table__.primary_key.columns)
+
+    stream = _csv_stream if format == "csv" else _ndjson_stream
+    return StreamingResponse(
+        stream(columns, statement),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="em_{table}.{format}"'},
+    )
@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy import case
 from typing import List
+from collections import defaultdict
+from datetime import datetime
 import models, schemas
 from database import SessionLocal
+import marketplace_holds as holds
+from marketplace_holds import MAX_HOLD_TTL_SECONDS
 
 router = APIRouter(
     prefix="/marketplace",
@@ -39,11 +44,11 @@ def create_marketplace_item(item: schemas.MarketplaceItemCreate, seller_id: int,
 
 @router.post("/orders/", response_model=schemas.MarketplaceOrder)
 def create_marketplace_order(order: schemas.MarketplaceOrderCreate, buyer_id: int, db: Session = Depends(get_db)):
-    item = db.query(models.MarketplaceItem).filter(models.MarketplaceItem.id == order.item_id).first()
+    item = holds.lock_items(db, [order.item_id]).get(order.item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
         
-    if item.stock_quantity < order.quantity:
+    if item.stock_quantity - holds.held_quantities(db, [item.id]).get(item.id, 0) < order.quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock")
         
     total_price = item.price * order.quantity
@@ -63,3 +68,128 @@ def create_marketplace_order(order: schemas.MarketplaceOrderCreate, buyer_id: in
     db.commit()
     db.refresh(db_order)
     return db_order
+
+@router.post("/checkout/", response_model=schemas.MarketplaceCheckout)
+def checkout_marketplace_cart(cart: schemas.MarketplaceCartCheckout, buyer_id: int, db: Session = Depends(get_db)):
+    if not cart.items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    quantities = defaultdict(int)
+    for line in cart.items:
+        if line.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        quantities[line.item_id] += line.quantity
+
+    # One locking read for every item in the cart, so holds placed meanwhile cannot oversell it
+    items = holds.lock_items(db, quantities)
+    missing = [item_id for item_id in quantities if item_id not in items]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Items not found: {missing}")
+    held = holds.held_quantities(db, quantities)
+    short = [item_id for item_id, qty in quantities.items() if items[item_id].stock_quantity - held.get(item_id, 0) < qty]
+    if short:
+        raise HTTPException(status_code=400, detail=f"Insufficient stock for items: {short}")
+
+    # One conditional write for every item; any shortfall aborts the whole cart
+    needed = case(quantities, value=models.MarketplaceItem.id)
+    updated = db.query(models.MarketplaceItem).filter(
+        models.MarketplaceItem.id.in_(list(quantities)),
+        models.MarketplaceItem.stock_quantity >= needed
+    ).update({models.MarketplaceItem.stock_quantity: models.MarketplaceItem.stock_quantity - needed}, synchronize_session=False)
+    if updated != len(quantities):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Insufficient stock, cart not checked out")
+
+    now = datetime.utcnow()
+    db_orders = [
+        models.MarketplaceOrder(
+            item_id=item_id,
+            buyer_id=buyer_id,
+            quantity=qty,
+            total_price=items[item_id].price * qty,
+            status="PENDING",
+            order_date=now
+        )
+        for item_id, qty in quantities.items()
+    ]
+    db.add_all(db_orders)
+    db.flush()
+    # Serialise before commit so the response needs no per-order refresh
+    orders = [
+        {
+            "id": o.id, "item_id": o.item_id, "buyer_id": o.buyer_id, "quantity": o.quantity,
+            "total_price": o.total_price, "status": o.status, "order_date": o.order_date
+        }
+        for o in db_orders
+    ]
+    db.commit()
+    return {"orders": orders, "total_price": sum(o["total_price"] for o in orders)}
+
+# --- Checkout Holds ---
+
+def _decrement_stock(db: Session, item_id: int, quantity: int) -> bool:
+    # Conditional decrement, so a concurrent buyer can never drive stock negative
+    updated = db.query(models.MarketplaceItem).filter(
+        models.MarketplaceItem.id == item_id,
+        models.MarketplaceItem.stock_quantity >= quantity
+    ).update({models.MarketplaceItem.stock_quantity: models.MarketplaceItem.stock_quantity - quantity}, synchronize_session=False)
+    return updated == 1
+
+@router.post("/holds/", response_model=schemas.MarketplaceHold)
+def create_marketplace_hold(hold: schemas.MarketplaceHoldCreate, buyer_id: int, db: Session = Depends(get_db)):
+    if hold.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    if hold.ttl_seconds <= 0 or hold.ttl_seconds > MAX_HOLD_TTL_SECONDS:
+        raise HTTPException(status_code=400, detail=f"ttl_seconds must be between 1 and {MAX_HOLD_TTL_SECONDS}")
+
+    item = holds.lock_items(db, [hold.item_id]).get(hold.item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    placed = holds.place(db, item, buyer_id, hold.quantity, hold.ttl_seconds)
+    if placed is None:
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+    db.commit()
+    db.refresh(placed)
+    return placed
+
+@router.get("/holds/{hold_id}", response_model=schemas.MarketplaceHold)
+def read_marketplace_hold(hold_id: str, buyer_id: int, db: Session = Depends(get_db)):
+    hold = holds.get(db, hold_id, buyer_id)
+    if hold is None:
+        raise HTTPException(status_code=404, detail="Hold not found or expired")
+    return hold
+
+@router.delete("/holds/{hold_id}")
+def release_marketplace_hold(hold_id: str, buyer_id: int, db: Session = Depends(get_db)):
+    if holds.claim(db, hold_id, buyer_id) is None:
+        raise HTTPException(status_code=404, detail="Hold not found or expired")
+    db.commit()
+    return {"message": "Hold released"}
+
+@router.post("/holds/{hold_id}/confirm", response_model=schemas.MarketplaceOrder)
+def confirm_marketplace_hold(hold_id: str, buyer_id: int, db: Session = Depends(get_db)):
+    # Claiming deletes the hold row, so concurrent confirms of one hold yield a single order;
+    # any failure below rolls back and the buyer keeps the reservation
+    hold = holds.claim(db, hold_id, buyer_id)
+    if hold is None:
+        raise HTTPException(status_code=404, detail="Hold not found or expired")
+
+    price = db.query(models.MarketplaceItem.price).filter(models.MarketplaceItem.id == hold.item_id).scalar()
+    if price is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Item not found")
+    if not _decrement_stock(db, hold.item_id, hold.quantity):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Insufficient stock")
+
+    db_order = models.MarketplaceOrder(
+        item_id=hold.item_id,
+        buyer_id=buyer_id,
+        quantity=hold.quantity,
+        total_price=price * hold.quantity,
+        status="PENDING"
+    )
+    db.add(db_order)
+    db.commit()
+    db.refresh(db_order)
+    return db_order
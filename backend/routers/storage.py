@@ -1,9 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from typing import List
+import numpy as np
 import models, schemas
 from database import SessionLocal
-from datetime import datetime
+from datetime import datetime, date
+from typing import Optional
+from storage_occupancy import (
+    occupancy_index, peak_booked_by_listing, day_range, day_bounds, billed_days, apply_booking_to_calendar, read_calendar,
+    ACTIVE_BOOKING_STATUSES
+)
+
+# Upper bound on the search window, keeps the listings x days matrix small
+MAX_SEARCH_DAYS = 730
+MAX_CALENDAR_DAYS = 731
 
 router = APIRouter(
     prefix="/storage",
@@ -22,6 +32,74 @@ def get_db():
 def read_storage_listings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return db.query(models.StorageRentalListing).filter(models.StorageRentalListing.is_active == True).offset(skip).limit(limit).all()
 
+@router.get("/availability/", response_model=List[schemas.StorageAvailability])
+def search_storage_availability(
+    start_date: datetime,
+    end_date: datetime,
+    min_free: float = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """Active listings with at least `min_free` capacity free on every day of the range, cheapest first."""
+    # Capacity is checked on every day the range touches; the quote uses the same billed days as a booking
+    start, end = day_range(start_date, end_date)
+    days = billed_days(start_date, end_date)
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
+    if end - start > MAX_SEARCH_DAYS:
+        raise HTTPException(status_code=400, detail=f"Search range cannot exceed {MAX_SEARCH_DAYS} days")
+
+    listings = db.query(
+        models.StorageRentalListing.id,
+        models.StorageRentalListing.capacity_available,
+        models.StorageRentalListing.price_per_day
+    ).filter(models.StorageRentalListing.is_active == True).order_by(models.StorageRentalListing.id).all()
+    if not listings:
+        return []
+    listing_ids = np.fromiter((l[0] for l in listings), dtype=np.int64, count=len(listings))
+    capacity = np.fromiter((l[1] or 0.0 for l in listings), dtype=float, count=len(listings))
+    price_per_day = np.fromiter((l[2] or 0.0 for l in listings), dtype=float, count=len(listings))
+
+    # All overlapping bookings in one read, then one matrix pass over listings x days
+    window_start, window_end = day_bounds(start, end)
+    bookings = db.query(
+        models.StorageBooking.listing_id,
+        models.StorageBooking.start_date,
+        models.StorageBooking.end_date,
+        models.StorageBooking.volume
+    ).join(models.StorageRentalListing, models.StorageRentalListing.id == models.StorageBooking.listing_id).filter(
+        models.StorageRentalListing.is_active == True,
+        models.StorageBooking.status.in_(ACTIVE_BOOKING_STATUSES),
+        # Bookings touching any day of the range, by the same whole-day model as day_range
+        models.StorageBooking.start_date < window_end,
+        models.StorageBooking.end_date > window_start
+    ).all()
+    peak = peak_booked_by_listing(listing_ids, bookings, start, end)
+    free = capacity - peak
+    total_price = price_per_day * days
+
+    matches = np.flatnonzero(free >= min_free)
+    matches = matches[np.argsort(total_price[matches], kind="stable")][:limit]
+    if not len(matches):
+        return []
+
+    page_ids = listing_ids[matches].tolist()
+    by_id = {
+        l.id: l for l in db.query(models.StorageRentalListing)
+        .options(joinedload(models.StorageRentalListing.facility))
+        .filter(models.StorageRentalListing.id.in_(page_ids))
+    }
+    return [
+        {
+            "listing": by_id[listing_id],
+            "days": days,
+            "peak_booked": float(peak[i]),
+            "free_capacity": float(free[i]),
+            "total_price": float(total_price[i]),
+        }
+        for listing_id, i in zip(page_ids, matches.tolist())
+    ]
+
 @router.post("/listings/", response_model=schemas.StorageListing)
 def create_storage_listing(listing: schemas.StorageListingCreate, owner_id: int, db: Session = Depends(get_db)):
     db_listing = models.StorageRentalListing(
@@ -36,17 +114,36 @@ def create_storage_listing(listing: schemas.StorageListingCreate, owner_id: int,
     db.refresh(db_listing)
     return db_listing
 
+def _lock_listing(db: Session, listing_id: int):
+    """Load a listing and hold its row lock until commit, so capacity checks and inserts on it serialise."""
+    if db.bind.dialect.name == "sqlite":
+        # No row locks on SQLite; a write takes the database write lock, which serialises bookings the same way
+        db.query(models.StorageRentalListing).filter(models.StorageRentalListing.id == listing_id).update(
+            {models.StorageRentalListing.id: models.StorageRentalListing.id}, synchronize_session=False
+        )
+    return db.query(models.StorageRentalListing).filter(models.StorageRentalListing.id == listing_id).with_for_update().first()
+
 @router.post("/bookings/", response_model=schemas.StorageBooking)
 def create_storage_booking(booking: schemas.StorageBookingCreate, renter_id: int, db: Session = Depends(get_db)):
-    # Calculate total price
-    duration = (booking.end_date - booking.start_date).days
+    # Billed per full 24 hours; capacity below is held on every calendar day the booking touches
+    duration = billed_days(booking.start_date, booking.end_date)
     if duration <= 0:
         raise HTTPException(status_code=400, detail="End date must be after start date")
         
-    listing = db.query(models.StorageRentalListing).filter(models.StorageRentalListing.id == booking.listing_id).first()
+    if booking.volume <= 0:
+        raise HTTPException(status_code=400, detail="Booked volume must be positive")
+
+    listing = _lock_listing(db, booking.listing_id)
     if not listing:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Listing not found")
-        
+
+    # Peak utilisation over the requested days must leave room for this booking
+    peak_booked = occupancy_index.peak_booked(db, listing.id, booking.start_date, booking.end_date)
+    if peak_booked + booking.volume > (listing.capacity_available or 0):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Insufficient storage capacity for the requested dates")
+
     total_price = duration * listing.price_per_day
     
     db_booking = models.StorageBooking(
@@ -54,14 +151,52 @@ def create_storage_booking(booking: schemas.StorageBookingCreate, renter_id: int
         renter_id=renter_id,
         start_date=booking.start_date,
         end_date=booking.end_date,
+        volume=booking.volume,
         total_price=total_price,
         status="CONFIRMED" # Auto-confirm for now
     )
     
-    # Update availability? For simplified MVP we just assume infinite or shared capacity
-    # listing.capacity_available -= ??? (Need booking amount)
-    
     db.add(db_booking)
+    apply_booking_to_calendar(db, db_booking)
     db.commit()
     db.refresh(db_booking)
+    occupancy_index.record_booking(db_booking)
     return db_booking
+
+@router.post("/bookings/{booking_id}/cancel", response_model=schemas.StorageBooking)
+def cancel_storage_booking(booking_id: int, renter_id: int, db: Session = Depends(get_db)):
+    db_booking = db.query(models.StorageBooking).filter(models.StorageBooking.id == booking_id).first()
+    if not db_booking or db_booking.renter_id != renter_id:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if db_booking.status not in ACTIVE_BOOKING_STATUSES:
+        raise HTTPException(status_code=400, detail="Booking is not active")
+
+    db_booking.status = "CANCELLED"
+    apply_booking_to_calendar(db, db_booking, sign=-1)
+    db.commit()
+    db.refresh(db_booking)
+    occupancy_index.invalidate(db_booking.listing_id)
+    return db_booking
+
+@router.get("/listings/{listing_id}/calendar", response_model=schemas.StorageCalendar)
+def read_storage_calendar(listing_id: int, start: Optional[date] = None, days: int = 365, db: Session = Depends(get_db)):
+    if days <= 0 or days > MAX_CALENDAR_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_CALENDAR_DAYS}")
+    listing = db.query(models.StorageRentalListing).filter(models.StorageRentalListing.id == listing_id).first()
+    if not listing:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    start = start or datetime.utcnow().date()
+    booked, revenue = read_calendar(db, listing_id, start, days)
+    capacity = listing.capacity_available or 0.0
+    utilisation = booked / capacity if capacity else np.zeros(days)
+    first = start.toordinal()
+    return {
+        "listing_id": listing_id,
+        "capacity_available": capacity,
+        "total_revenue": float(revenue.sum()),
+        "days": [
+            {"day": date.fromordinal(first + i), "booked_volume": b, "capacity": capacity, "utilisation": u, "revenue": r}
+            for i, (b, u, r) in enumerate(zip(booked.tolist(), utilisation.tolist(), revenue.tolist()))
+        ],
+    }
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, date
 from enum import Enum
 
 # --- Enums matching Models ---
@@ -207,16 +207,37 @@ class StorageBookingBase(BaseModel):
     end_date: datetime
 
 class StorageBookingCreate(StorageBookingBase):
-    pass
+    volume: float # tons or m3, same unit as listing capacity
 
 class StorageBooking(StorageBookingBase):
     id: int
+    volume: Optional[float] = None # NULL on bookings made before volumes were recorded
     renter_id: int
     total_price: float
     status: str
     class Config:
         orm_mode = True
 
+class StorageAvailability(BaseModel):
+    listing: StorageListing
+    days: int
+    peak_booked: float
+    free_capacity: float
+    total_price: float
+
+class StorageCalendarDay(BaseModel):
+    day: date
+    booked_volume: float
+    capacity: float
+    utilisation: float
+    revenue: float
+
+class StorageCalendar(BaseModel):
+    listing_id: int
+    capacity_available: float
+    total_revenue: float
+    days: List[StorageCalendarDay]
+
 # --- Marketplace Schemas ---
 class MarketplaceItemBase(BaseModel):
     name: str
@@ -252,6 +273,23 @@ class MarketplaceOrder(MarketplaceOrderBase):
     class Config:
         orm_mode = True
 
+class MarketplaceHoldCreate(MarketplaceOrderBase):
+    ttl_seconds: int = 600
+
+class MarketplaceHold(MarketplaceOrderBase):
+    hold_id: str
+    buyer_id: int
+    expires_at: datetime
+    class Config:
+        orm_mode = True
+
+class MarketplaceCartCheckout(BaseModel):
+    items: List[MarketplaceOrderBase]
+
+class MarketplaceCheckout(BaseModel):
+    orders: List[MarketplaceOrder]
+    total_price: float
+
 # --- Auth Flow (Signup) Schemas ---
 class SignupStep1Request(BaseModel):
     email: str
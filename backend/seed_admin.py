@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session
 from database import SessionLocal
-import models, auth
+import models, auth, crud
 
 def seed_admin():
     db = SessionLocal()
@@ -9,7 +9,7 @@ def seed_admin():
     password = "adminpassword123"
     
     # Check if admin exists
-    existing = db.query(models.Participant).filter(models.Participant.email == email).first()
+    existing = crud.get_participant_by_email(db, email=email)
     if existing:
         print(f"Admin user {email} already exists.")
         db.close()
@@ -0,0 +1,280 @@
+"""
+Per-listing day occupancy index for storage bookings.
+
+Each listing keeps a dense numpy array of booked volume per calendar day, so
+admission checks are a slice-and-max over the requested range instead of a
+scan over every overlapping booking.
+"""
+
+import itertools
+import threading
+from datetime import datetime, date, time
+
+import numpy as np
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import models
+
+# Bookings in these states hold capacity
+ACTIVE_BOOKING_STATUSES = ("CONFIRMED",)
+
+CALENDAR_INSERT_CHUNK = 1000
+
+
+def billed_days(start_date: datetime, end_date: datetime) -> int:
+    """Whole 24-hour periods a booking is charged for."""
+    return (end_date - start_date).days
+
+
+def day_range(start_date: datetime, end_date: datetime):
+    """
+    Half-open [start, end) range of day ordinals a booking touches; a part day
+    counts as a whole one. Admission and the calendar use this, so capacity is
+    held on every day the goods are in storage; billed_days sets the price.
+    """
+    end = end_date.toordinal()
+    if end_date.time() != time.min:
+        end += 1
+    return start_date.toordinal(), end
+
+
+def day_bounds(start: int, end: int):
+    """Midnight datetimes bounding days [start, end), for overlap filters on booking dates."""
+    return datetime.combine(date.fromordinal(start), time.min), datetime.combine(date.fromordinal(end), time.min)
+
+
+def occupancy_from_intervals(starts, ends, volumes, origin: int, days: int) -> np.ndarray:
+    """Booked volume per day for `days` days from `origin`, via a difference array."""
+    starts = np.clip(np.asarray(starts, dtype=np.int64) - origin, 0, days)
+    ends = np.clip(np.asarray(ends, dtype=np.int64) - origin, 0, days)
+    diff = np.zeros(days + 1)
+    np.add.at(diff, starts, volumes)
+    np.add.at(diff, ends, np.negative(volumes))
+    return np.cumsum(diff[:-1])
+
+
+def peak_booked_by_listing(listing_ids: np.ndarray, bookings, start: int, end: int) -> np.ndarray:
+    """
+    Peak booked volume over days [start, end) for every listing at once.
+
+    `listing_ids` must be sorted; `bookings` is a sequence of
+    (listing_id, start_date, end_date, volume) rows overlapping the range.
+    """
+    days = end - start
+    peaks = np.zeros(len(listing_ids))
+    if not len(bookings) or not len(listing_ids) or days <= 0:
+        return peaks
+    booking_listing = np.fromiter((b[0] for b in bookings), dtype=np.int64, count=len(bookings))
+    rows = np.searchsorted(listing_ids, booking_listing)
+    known = (rows < len(listing_ids)) & (listing_ids[np.minimum(rows, len(listing_ids) - 1)] == booking_listing)
+    spans = [day_range(b[1], b[2]) for b in bookings]
+    starts = np.fromiter((span[0] for span in spans), dtype=np.int64, count=len(spans))
+    ends = np.fromiter((span[1] for span in spans), dtype=np.int64, count=len(spans))
+    volumes = np.fromiter((b[3] or 0.0 for b in bookings), dtype=float, count=len(bookings))
+    rows, starts, ends, volumes = rows[known], starts[known], ends[known], volumes[known]
+    starts = np.clip(starts - start, 0, days)
+    ends = np.clip(ends - start, 0, days)
+    diff = np.zeros((len(listing_ids), days + 1))
+    np.add.at(diff, (rows, starts), volumes)
+    np.add.at(diff, (rows, ends), -volumes)
+    return np.cumsum(diff[:, :-1], axis=1).max(axis=1)
+
+
+def _upsert(db: Session):
+    return postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+
+
+def apply_booking_to_calendar(db: Session, booking: models.StorageBooking, sign: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) a booking's volume and revenue in the
+    per-day occupancy table. Runs in the caller's transaction, no commit.
+    """
+    start, end = day_range(booking.start_date, booking.end_date)
+    days = end - start
+    if days <= 0:
+        return
+    volume = sign * (booking.volume or 0.0)
+    revenue = sign * (booking.total_price or 0.0) / days
+    # One upsert, so two bookings creating the same missing day both land instead of colliding
+    table = models.StorageOccupancyDay.__table__
+    statement = _upsert(db)(table).values([
+        {"listing_id": booking.listing_id, "day": date.fromordinal(ordinal), "booked_volume": volume, "revenue": revenue}
+        for ordinal in range(start, end)
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.listing_id, table.c.day],
+        set_={
+            "booked_volume": table.c.booked_volume + statement.excluded.booked_volume,
+            "revenue": table.c.revenue + statement.excluded.revenue,
+        },
+    ))
+
+
+def rebuild_calendar(conn: Connection) -> int:
+    """
+    Recompute every storage_occupancy_days row from the active bookings.
+    Runs in the caller's transaction; returns the number of day rows written.
+    """
+    table = models.StorageOccupancyDay.__table__
+    bookings = models.StorageBooking.__table__
+    rows = conn.execute(
+        select(bookings.c.listing_id, bookings.c.start_date, bookings.c.end_date, bookings.c.volume, bookings.c.total_price)
+        .where(bookings.c.status.in_(ACTIVE_BOOKING_STATUSES), bookings.c.listing_id.is_not(None))
+        .order_by(bookings.c.listing_id)
+    ).all()
+    conn.execute(table.delete())
+
+    written = 0
+    for listing_id, group in itertools.groupby(rows, key=lambda r: r.listing_id):
+        group = [(r, day_range(r.start_date, r.end_date)) for r in group if r.start_date and r.end_date]
+        group = [(r, span) for r, span in group if span[1] > span[0]]
+        if not group:
+            continue
+        starts = np.array([span[0] for _, span in group], dtype=np.int64)
+        ends = np.array([span[1] for _, span in group], dtype=np.int64)
+        volumes = np.array([r.volume or 0.0 for r, _ in group])
+        daily_revenue = np.array([r.total_price or 0.0 for r, _ in group]) / (ends - starts)
+        origin = int(starts.min())
+        days = int(ends.max()) - origin
+        booked = occupancy_from_intervals(starts, ends, volumes, origin, days)
+        revenue = occupancy_from_intervals(starts, ends, daily_revenue, origin, days)
+        covered = np.flatnonzero(occupancy_from_intervals(starts, ends, np.ones(len(starts)), origin, days) > 0)
+        day_rows = [
+            {"listing_id": listing_id, "day": date.fromordinal(origin + i), "booked_volume": float(booked[i]), "revenue": float(revenue[i])}
+            for i in covered.tolist()
+        ]
+        for chunk_start in range(0, len(day_rows), CALENDAR_INSERT_CHUNK):
+            conn.execute(insert(table), day_rows[chunk_start:chunk_start + CALENDAR_INSERT_CHUNK])
+        written += len(day_rows)
+    return written
+
+
+def read_calendar(db: Session, listing_id: int, start: date, days: int):
+    """Booked volume and revenue arrays for `days` days from `start`, from one range read."""
+    booked = np.zeros(days)
+    revenue = np.zeros(days)
+    rows = db.query(
+        models.StorageOccupancyDay.day,
+        models.StorageOccupancyDay.booked_volume,
+        models.StorageOccupancyDay.revenue
+    ).filter(
+        models.StorageOccupancyDay.listing_id == listing_id,
+        models.StorageOccupancyDay.day >= start,
+        models.StorageOccupancyDay.day < date.fromordinal(start.toordinal() + days)
+    ).all()
+    if rows:
+        offsets = np.fromiter((r[0].toordinal() for r in rows), dtype=np.int64, count=len(rows)) - start.toordinal()
+        booked[offsets] = [r[1] or 0.0 for r in rows]
+        revenue[offsets] = [r[2] or 0.0 for r in rows]
+    return booked, revenue
+
+
+class ListingOccupancy:
+    """Booked volume per day for one listing. `volume[i]` is day `origin + i`."""
+
+    def __init__(self, origin: int = 0, volume: np.ndarray = None, signature=None):
+        self.origin = origin
+        self.volume = volume if volume is not None else np.zeros(0)
+        self.signature = signature
+
+    def _ensure(self, start: int, end: int):
+        if not len(self.volume):
+            self.origin = start
+            self.volume = np.zeros(end - start)
+            return
+        lo = min(self.origin, start)
+        hi = max(self.origin + len(self.volume), end)
+        if lo == self.origin and hi == self.origin + len(self.volume):
+            return
+        grown = np.zeros(hi - lo)
+        offset = self.origin - lo
+        grown[offset:offset + len(self.volume)] = self.volume
+        self.origin, self.volume = lo, grown
+
+    def add(self, start: int, end: int, volume: float):
+        if end <= start:
+            return
+        self._ensure(start, end)
+        self.volume[start - self.origin:end - self.origin] += volume
+
+    def peak(self, start: int, end: int) -> float:
+        lo = max(start, self.origin) - self.origin
+        hi = min(end, self.origin + len(self.volume)) - self.origin
+        if hi <= lo:
+            return 0.0
+        return float(self.volume[lo:hi].max())
+
+
+class OccupancyIndex:
+    """
+    Process-wide cache of ListingOccupancy arrays.
+
+    Each listing is validated against a (count, max id) signature of its active
+    bookings, so bookings made by other workers trigger a reload of that listing.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, db: Session, listing_id: int):
+        return tuple(db.query(func.count(models.StorageBooking.id), func.max(models.StorageBooking.id)).filter(
+            models.StorageBooking.listing_id == listing_id,
+            models.StorageBooking.status.in_(ACTIVE_BOOKING_STATUSES)
+        ).one())
+
+    def _load(self, db: Session, listing_id: int, signature) -> ListingOccupancy:
+        rows = db.query(
+            models.StorageBooking.start_date,
+            models.StorageBooking.end_date,
+            func.coalesce(models.StorageBooking.volume, 0.0)
+        ).filter(
+            models.StorageBooking.listing_id == listing_id,
+            models.StorageBooking.status.in_(ACTIVE_BOOKING_STATUSES)
+        ).all()
+        if not rows:
+            return ListingOccupancy(signature=signature)
+        spans = [day_range(r[0], r[1]) for r in rows]
+        starts = np.fromiter((span[0] for span in spans), dtype=np.int64, count=len(spans))
+        ends = np.fromiter((span[1] for span in spans), dtype=np.int64, count=len(spans))
+        volumes = np.fromiter((r[2] for r in rows), dtype=float, count=len(rows))
+        origin = int(starts.min())
+        days = max(int(ends.max()) - origin, 0)
+        return ListingOccupancy(origin, occupancy_from_intervals(starts, ends, volumes, origin, days), signature)
+
+    def sync(self, db: Session, listing_id: int) -> ListingOccupancy:
+        signature = self._signature(db, listing_id)
+        with self._lock:
+            entry = self._listings.get(listing_id)
+            if entry is not None and entry.signature == signature:
+                return entry
+        entry = self._load(db, listing_id, signature)
+        with self._lock:
+            self._listings[listing_id] = entry
+        return entry
+
+    def peak_booked(self, db: Session, listing_id: int, start_date: datetime, end_date: datetime) -> float:
+        """Highest booked volume on any day in [start_date, end_date)."""
+        entry = self.sync(db, listing_id)
+        with self._lock:
+            return entry.peak(*day_range(start_date, end_date))
+
+    def record_booking(self, booking: models.StorageBooking):
+        """Apply a just-committed booking without reloading the listing."""
+        with self._lock:
+            entry = self._listings.get(booking.listing_id)
+            if entry is None or entry.signature is None:
+                return
+            count, max_id = entry.signature
+            entry.add(*day_range(booking.start_date, booking.end_date), booking.volume or 0.0)
+            entry.signature = (count + 1, max(max_id or 0, booking.id))
+
+    def invalidate(self, listing_id: int):
+        with self._lock:
+            self._listings.pop(listing_id, None)
+
+
+occupancy_index = OccupancyIndex()
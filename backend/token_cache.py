@@ -0,0 +1,74 @@
+"""
+Bounded LRU of verified JWT claims.
+
+Keys are SHA-256 digests of the raw token, so tokens are never held in
+memory. An entry is served until the token's own `exp`, skipping signature
+verification; invalidate_subject() drops every cached token for an account.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = JWT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # digest -> (exp, claims)
+        self._by_subject = {}  # sub -> set of digests
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _remove(self, digest: bytes):
+        _, claims = self._entries.pop(digest)
+        digests = self._by_subject.get(claims.get("sub"))
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_subject[claims.get("sub")]
+
+    def get(self, token: str) -> Optional[dict]:
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(digest)
+                return None
+            self._entries.move_to_end(digest)
+            return dict(entry[1])
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)) or self.max_entries <= 0:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (exp, dict(claims))
+            self._by_subject.setdefault(claims.get("sub"), set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_subject(self, subject: str):
+        with self._lock:
+            for digest in list(self._by_subject.get(subject, ())):
+                self._remove(digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_subject.clear()
+
+
+token_cache = TokenCache()